@@ -0,0 +1,219 @@
+import sys
+import numpy as np
+
+'''
+Reads the edges of a weighted directed graph for longestPath.py.
+
+The text format is the one longestPath.py has always read: a line with the
+source node, a line with the sink node, then one edge per line as
+node->out node:weight. It is read in large binary blocks and each block is
+parsed with array operations: the line ends, arrows and colons are found by
+comparing every byte at once, and the labels and weights are gathered from
+those positions into fixed width arrays. Labels made only of digits are kept
+as integers, which are much faster to sort when the nodes are numbered.
+
+The binary format is a flat file of little endian int64 (node, out node,
+weight) triples, for programs that write the edges themselves. Its nodes are
+the integers, and the source and sink are given separately.
+'''
+
+
+class EdgeReader:
+    '''
+    Reads the source, sink and edges of a graph file.
+
+    Attributes:
+        fname = the graph file to read, stdin is used when it is empty
+        binary = True when the file holds int64 (node, out node, weight)
+                 triples instead of text
+        blockSize = the number of bytes of text read at a time
+    '''
+    #bytes trimmed from both ends of the labels and weights of an edge line
+    space = np.zeros(256, dtype=bool)
+    space[list(b' \t\r\x0b\x0c')] = True
+    #labels and weights are parsed as integers up to this many digits
+    maxDigits = 18
+
+    def __init__(self, fname='', binary=False, blockSize=1 << 24):
+        self.fname = fname
+        self.binary = binary
+        self.blockSize = blockSize
+
+    def doOpen(self):
+        '''
+        opens the graph file in binary mode
+        '''
+        if self.fname == '':
+            return sys.stdin.buffer
+        else:
+            return open(self.fname, 'rb')
+
+    def readLines(self, fileH):
+        '''
+        yields blocks of complete lines from the file. a line longer than a
+        block is collected in a list until its end is found
+        '''
+        pending = []
+        while True:
+            block = fileH.read(self.blockSize)
+            if not block:
+                break
+            end = block.rfind(b'\n')
+            if end < 0:
+                pending.append(block)
+                continue
+            if pending:
+                pending.append(block[:end+1])
+                yield b''.join(pending)
+                pending = []
+            else:
+                yield block[:end+1]
+            if end + 1 < len(block):
+                pending.append(block[end+1:])
+        if pending:
+            yield b''.join(pending) + b'\n'
+
+    def readGraph(self):
+        '''
+        returns the source and sink labels of a text file (None for a binary
+        file) and arrays of the node, out node and weight of every edge
+        '''
+        if self.binary:
+            if self.fname == '':
+                triples = np.frombuffer(sys.stdin.buffer.read(), dtype='<i8')
+            else:
+                triples = np.fromfile(self.fname, dtype='<i8')
+            if len(triples) % 3:
+                raise ValueError('a binary edge file holds whole (node, out node, weight) triples')
+            triples = triples.reshape(-1, 3).astype(np.int64)
+            return None, None, triples[:, 0], triples[:, 1], triples[:, 2]
+        sources = []
+        targets = []
+        weights = []
+        with self.doOpen() as fileH:
+            i_node = fileH.readline().strip().decode()
+            o_node = fileH.readline().strip().decode()
+            for block in self.readLines(fileH):
+                s, t, w = self.parseEdges(block)
+                sources.append(s)
+                targets.append(t)
+                weights.append(w)
+        sources = self.joinLabels(sources)
+        targets = self.joinLabels(targets)
+        weights = np.concatenate(weights) if weights else np.zeros(0, dtype=np.int64)
+        return i_node, o_node, sources, targets, weights
+
+    def parseEdges(self, block):
+        '''
+        returns the node and out node labels and the weights of the edge
+        lines in a block of complete lines. whitespace around a label or
+        weight is dropped, whitespace inside a label is kept
+        '''
+        text = np.frombuffer(block, dtype=np.uint8)
+        ends = np.flatnonzero(text == ord('\n'))
+        starts = np.concatenate(([0], ends[:-1] + 1))
+        #the positions of every byte other than whitespace, newlines included
+        #so a blank line ends at its first one
+        space = self.space[text]
+        filled = np.flatnonzero(~space) if space.any() else None
+        #skip the blank lines
+        if filled is None:
+            full = ends > starts
+        else:
+            full = filled[np.searchsorted(filled, starts)] < ends
+        starts, ends = starts[full], ends[full]
+        arrows = np.flatnonzero((text[:-1] == ord('-')) & (text[1:] == ord('>')))
+        colons = np.flatnonzero(text == ord(':'))
+        #every line needs exactly one arrow followed by one colon, so the
+        #ith arrow and colon both fall between the ends of lines i-1 and i
+        if (len(arrows) != len(ends) or len(colons) != len(ends)
+                or (arrows < starts).any() or (colons < arrows + 2).any()
+                or (colons >= ends).any()):
+            raise ValueError('edge lines must look like node->out node:weight')
+        weights = self.parseIntegers(text, *self.trim(filled, colons + 1, ends))
+        if weights is None:
+            raise ValueError('edge weights must be integers')
+        return self.parseLabels(text, *self.trim(filled, starts, arrows)), self.parseLabels(text, *self.trim(filled, arrows + 2, colons)), weights
+
+    def trim(self, filled, starts, ends):
+        '''
+        returns the starts and ends of the fields text[starts[i]:ends[i]]
+        without the whitespace at either end, given the positions of the
+        bytes that are not whitespace (None when there is no whitespace)
+        '''
+        if filled is None or not len(starts):
+            return starts, ends
+        first = filled[np.searchsorted(filled, starts)]
+        last = filled[np.searchsorted(filled, ends) - 1] + 1
+        #a field of only whitespace is left empty
+        return first, np.where(first < ends, last, first)
+
+    def gather(self, text, starts, ends):
+        '''
+        returns a matrix holding the bytes text[starts[i]:ends[i]] in row i,
+        padded with zeros on the right
+        '''
+        width = int((ends - starts).max()) if len(starts) else 0
+        matrix = np.zeros((len(starts), width), dtype=np.uint8)
+        for j in range(width):
+            positions = starts + j
+            inside = positions < ends
+            matrix[inside, j] = text[positions[inside]]
+        return matrix
+
+    def parseIntegers(self, text, starts, ends):
+        '''
+        returns the signed decimal integers text[starts[i]:ends[i]], or None
+        if any of them is not one
+        '''
+        if not len(starts):
+            return np.zeros(0, dtype=np.int64)
+        negative = text[starts] == ord('-')
+        starts = starts + negative
+        lengths = ends - starts
+        if lengths.min() < 1 or lengths.max() > self.maxDigits:
+            return None
+        #the numbers are read one digit column at a time, aligned on their
+        #last digit so the shorter ones start with zeros
+        width = int(lengths.max())
+        values = np.zeros(len(starts), dtype=np.int64)
+        for j in range(width):
+            positions = ends - width + j
+            inside = positions >= starts
+            digits = text[positions] - np.uint8(ord('0'))
+            if (inside & (digits > 9)).any():
+                return None
+            values *= 10
+            values += np.where(inside, digits, 0)
+        return np.where(negative, -values, values)
+
+    def parseLabels(self, text, starts, ends):
+        '''
+        returns the labels text[starts[i]:ends[i]] as integers when every
+        one is a number written without leading zeros, or else as a fixed
+        width bytes array
+        '''
+        if len(starts) and (ends - starts).min() < 1:
+            raise ValueError('node labels cannot be empty')
+        if len(starts):
+            first = text[starts]
+            plain = ((first != ord('0')) | (ends - starts == 1)) & (first != ord('-'))
+            if plain.all():
+                values = self.parseIntegers(text, starts, ends)
+                if values is not None:
+                    return values
+        labels = self.gather(text, starts, ends)
+        if not labels.shape[1]:
+            return np.zeros(0, dtype='S1')
+        return labels.view('S{0}'.format(labels.shape[1])).ravel()
+
+    def joinLabels(self, pieces):
+        '''
+        joins the labels parsed from each block, as bytes if any block's
+        labels were not all integers
+        '''
+        if not pieces:
+            return np.zeros(0, dtype=np.int64)
+        if any(piece.dtype.kind == 'S' for piece in pieces):
+            pieces = [piece.astype('S') for piece in pieces]
+        return np.concatenate(pieces)
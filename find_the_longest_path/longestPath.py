@@ -4,7 +4,8 @@
 # Github acct: edevog
 
 import sys
-import re
+import numpy as np
+from edgeReader import EdgeReader
 
 '''
 This program finds the longest path through a directed graph given a source and
@@ -22,255 +23,635 @@ respectively. The rest of the text file is an adjacency graph with edge weights
 1->4:1
 3->4:3
 
+The graph is read from standard in, or from a file given with -g. A graph
+written by another program can instead be a binary file of little endian int64
+(node, out node, weight) triples (-b), with the source and sink given with -s
+and -t, which also replace the first two lines of a text graph:
+longestPath.py -b -g edges.bin -s 0 -t 4
+
+Many source and sink pairs can be answered from one reading of the graph with
+-q, a file with a source and a sink on each line, using -w worker processes:
+longestPath.py -g graph.txt -q queries.txt -w 4
+
+-k reports the k longest paths from the source to the sink instead of one.
+
 Output:
 The first line is the path's score. The second line is the path taken delimited
 by arrows.
 9
 0->2->3->4
+
+With -k, the score and path lines of each path, best first. With -q, one line
+per query with its source, sink, score and path separated by tabs.
 '''
 
 class LongestPath:
     '''
     Finds the longest path in the provided adjacency graph.
 
+    The nodes are numbered 0 to n-1 in the sorted order of their labels and
+    the edges are stored in compressed sparse row form: the edges out of
+    node u are targets[offsets[u]:offsets[u+1]] with the matching weights.
+
     Attributes:
-        data = adjacency graph provided by the data file from standard in
+        data = adjacency graph provided by the data file from standard in,
+               as a list of node->out node:weight lines
+        edges = arrays of the node, out node and weight of every edge, used
+                instead of data when given (as EdgeReader.readGraph reads them)
         i_node = the source node specified in the data file
         o_node = the sink node specified in the data file
+        labels = numpy array of the node labels, indexed by node id
+        offsets = numpy int64 array, the edges out of node u start at
+                  offsets[u] and end at offsets[u+1]
+        targets = numpy int64 array of the node each edge goes to
+        weights = numpy int64 array of the weight of each edge
+        inOffsets = numpy int64 array, the edges into node v are
+                    inTails[inOffsets[v]:inOffsets[v+1]], or None until
+                    makeReverse is called
+        inTails = numpy int64 array of the node each edge into a node leaves
+        edgeOrder = numpy int64 array giving each edge a key that sorts the
+                    edges the way the input lists them, grouped by node in
+                    the order the nodes first appear, or None when the
+                    input already lists the edges in node order
     '''
-    def __init__(self, data, i_node, o_node):
+    #the score of a node the source cannot reach
+    unreached = -sys.maxsize
+    #queues of at most this many nodes are run with a plain loop, which is
+    #faster than a round of array calls on the long chains of a deep graph
+    smallQueue = 16
+
+    def __init__(self, data, i_node, o_node, edges=None):
         self.data = data
         self.i_node = i_node
         self.o_node = o_node
+        if edges is None:
+            edges = self.makeEdges()
+        self.makeGraph(*edges)
+        self.inOffsets = None
+        self.inTails = None
 
-    def makeOutDict(self):
-        '''
-        creates a diction of nodes as keys, their out node, weight, and a boolean to
-        track if they have been used as the values
-        '''
-        out_dict = {}
-        for d in self.data:
-            #for each line in the adjacency graph split it into a list
-            #on the arrow and colon
-            l = re.split('\->|:', d)
-            #remove the first value of the list and store it as the node
-            n = l[0]
-            #remove the first value of the updated list and store it as the
-            #out node
-            out = l[1]
-            #set the final value in the list as the weight and define it as
-            #an integer
-            wt = int(l[2])
-            #if the node is not already in the dictionary, store it as a key
-            #and set the output node and weight as its values
-            if n not in out_dict:
-                out_dict[n] = [[out], [wt]]
-            else:
-                #if the node is already in the dictionary, append the out node
-                #and weight values to the exisiting list
-                out_dict[n][0].append(out)
-                out_dict[n][1].append(wt)
-        return out_dict
-
-    def makeInDict(self, out_dict):
-        '''
-        Makes an input dictionary using the existing dictionary
-        of outputs (matchDict)
-        '''
-        in_dict = {}
-        unique = []
-        #iterate through each node in the output dictionary,
-        for key in out_dict:
-            #iterate through each output of the node
-            for i in range(len(out_dict[key][0])):
-                #set the input node as the ith output node
-                n_in = out_dict[key][0][i]
-                #set the input node's weight as the ith weight of the
-                #output node
-                wt = out_dict[key][1][i]
-                #if the input node is not already in the dictionary,
-                if n_in not in in_dict:
-                    unique.append(n_in)
-                    #create a new key as the input node and the values as the
-                    #key from the output dictionary and the input node's weight
-                    in_dict[n_in] = [[key], [wt]]
-                #if the input node is already in the dictionary,
-                else:
-                    #append the key from the output dictionary and the
-                    #input node's weight to the existing list
-                    in_dict[n_in][0].append(key)
-                    in_dict[n_in][1].append(wt)
-            #after iterating through all the output nodes check if any nodes in
-            #the output dictionary are not in the input dictionary and add
-            #any missing nodes so the input dictionary contains all nodes in
-            #the graph
-            if key not in in_dict:
-                in_dict[key] = [[],[]]
-        return in_dict
-
-    def makeIODicts(self):
-        '''
-        Calls the functions to make the input and output dictionaries, then
-        updates the output dictionary to include all the nodes in the input
-        dictionary so the output dictionary has every node in the graph
-        '''
-        #make the output dictionary
-        out_dict = self.makeOutDict()
-        #make the input dictionary
-        in_dict = self.makeInDict(out_dict)
-        #if any nodes in the input dictionary are not in the output dictionary,
-        #add them to the output dictionary so it contains all nodes in the graph
-        for key in in_dict:
-            if key not in out_dict:
-                out_dict[key] = [[],[]]
-        return out_dict, in_dict
-
-    def makeScoreDict(self, out_dict, in_dict):
-        '''
-        This dictionary stores the scores for each node as we find the
-        longest path.
-        '''
-        score_dict = {}
-        count_dict = self.makeCountDict(out_dict, in_dict)
-        for n in count_dict:
-            if n != self.i_node:
-                #we want all source nodes to have a lower score than our
-                #specified source node
-                score_dict[n] = [-sys.maxsize, str()]
-            elif n == self.i_node:
-                #any nodes that have an input will have their score calculated
-                #when we iterate through our topological order
-                score_dict[n] = [int(), str()]
-
-        return score_dict
-
-
-
-    def makeCountDict(self, out_dict, in_dict):
-        '''
-        make a dictionary of nodes and a count of how many inputs they have
-        '''
-        count_dict = {}
-        #iterates through each node in the output dictionary
-        for n in out_dict:
-            #if the node is not in the input dictionary, store it's count in
-            #the count dictionary as 0
-            if n not in in_dict:
-                count_dict[n] = 0
+    def makeEdges(self):
+        '''
+        splits each line of the adjacency graph into its node, out node and
+        weight, returning the labels of both ends and the weights as arrays
+        '''
+        #the lines are parsed together as one block of text
+        block = ''.join(d + '\n' for d in self.data).encode()
+        return EdgeReader().parseEdges(block)
+
+    def makeGraph(self, sources, targets, weights):
+        '''
+        numbers the nodes by their sorted labels and stores the edges grouped
+        by the node they leave
+        '''
+        #labels read as integers at one end and bytes at the other are
+        #compared as bytes
+        if sources.dtype.kind != targets.dtype.kind:
+            sources, targets = sources.astype('S'), targets.astype('S')
+        self.labels, ids = self.internLabels(np.concatenate((sources, targets)))
+        tails = ids[:len(sources)]
+        heads = ids[len(sources):]
+        self.edgeOrder = None
+        self.offsets = np.zeros(len(self.labels) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(tails, minlength=len(self.labels)), out=self.offsets[1:])
+        if (tails[1:] < tails[:-1]).any():
+            #sorting on node * edges + edge keeps each node's edges in input
+            #order at the speed of an unstable sort
+            order = np.argsort(tails * len(tails) + np.arange(len(tails)))
+            heads = heads[order]
+            weights = np.asarray(weights, dtype=np.int64)[order]
+            #a node's first edge in the input orders it among the nodes, so
+            #ties between paths go the way they did before the edges were
+            #grouped by node id
+            counts = np.diff(self.offsets)
+            firstOfNode = np.zeros(len(self.labels), dtype=np.int64)
+            firstOfNode[counts > 0] = order[self.offsets[:-1][counts > 0]]
+            self.edgeOrder = np.repeat(firstOfNode, counts)
+            self.edgeOrder *= len(tails)
+            self.edgeOrder += order
+        self.targets = heads
+        self.weights = np.asarray(weights, dtype=np.int64)
+
+    def internLabels(self, labels):
+        '''
+        returns the sorted unique labels and the id of each label. node
+        numbers that are not much larger than the number of labels are
+        looked up in a table instead of sorted
+        '''
+        if labels.dtype.kind == 'i' and len(labels) and labels.min() >= 0 and labels.max() < 4*len(labels):
+            present = np.zeros(int(labels.max()) + 1, dtype=bool)
+            present[labels] = True
+            ids = np.cumsum(present, dtype=np.int64) - 1
+            return np.flatnonzero(present).astype(np.int64), ids[labels]
+        #one sort of every label gives the unique labels and the id of each
+        #edge end
+        unique, ids = np.unique(labels, return_inverse=True)
+        return unique, ids.astype(np.int64).ravel()
+
+    def nodeId(self, label):
+        '''
+        returns the id of the node with a label
+        '''
+        try:
+            key = np.array(label.encode() if self.labels.dtype.kind == 'S' else label).astype(self.labels.dtype)
+        except ValueError:
+            raise KeyError(label)
+        i = np.searchsorted(self.labels, key)
+        if i == len(self.labels) or self.labels[i] != key or self.labelText(i) != str(label):
+            raise KeyError(label)
+        return int(i)
+
+    def labelText(self, node):
+        '''
+        returns the label of a node as a string
+        '''
+        label = self.labels[node]
+        return label.decode() if isinstance(label, bytes) else str(label)
+
+    def edgesOf(self, nodes, offsets=None):
+        '''
+        returns the index of every edge out of an array of nodes and the node
+        each one leaves, in the graph's edges or in another set of edges
+        grouped by node with its own offsets
+        '''
+        if offsets is None:
+            offsets = self.offsets
+        if len(nodes) == 1:
+            #a single node's edges are one slice, the common case on long
+            #chains of nodes
+            start, end = offsets[nodes[0]], offsets[nodes[0] + 1]
+            return np.arange(start, end), nodes.repeat(end - start)
+        starts = offsets[nodes]
+        counts = offsets[nodes + 1] - starts
+        #each node's edges are a run of consecutive indices from its offset
+        runStarts = np.cumsum(counts) - counts
+        edges = np.arange(counts.sum(), dtype=np.int64) + np.repeat(starts - runStarts, counts)
+        return edges, np.repeat(nodes, counts)
+
+    def makeReverse(self):
+        '''
+        groups the edges by the node they enter once, for the searches back
+        from the sinks of many queries
+        '''
+        tails = np.repeat(np.arange(len(self.labels), dtype=np.int64), np.diff(self.offsets))
+        order = np.argsort(self.targets * len(self.targets) + np.arange(len(self.targets)))
+        self.inTails = tails[order]
+        self.inOffsets = np.zeros(len(self.labels) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.targets, minlength=len(self.labels)), out=self.inOffsets[1:])
+
+    def reach(self, nodes, offsets, targets, within=None):
+        '''
+        returns a boolean array that is True for every node reachable from
+        an array of nodes along the edges grouped by offsets with the given
+        targets, only through nodes that are True in within when it is
+        given, found a whole frontier of nodes at a time
+        '''
+        seen = np.zeros(len(self.labels), dtype=bool)
+        seen[nodes] = True
+        q = np.unique(nodes)
+        while len(q):
+            if len(q) <= self.smallQueue:
+                q = q if isinstance(q, list) else q.tolist()
+                found = []
+                for node in q:
+                    for edge in range(offsets.item(node), offsets.item(node + 1)):
+                        head = targets.item(edge)
+                        if not seen.item(head) and (within is None or within.item(head)):
+                            seen[head] = True
+                            found.append(head)
+                q = found if len(found) <= self.smallQueue else np.array(found, dtype=np.int64)
+                continue
+            edges, tails = self.edgesOf(q, offsets)
+            heads = targets[edges]
+            if within is None:
+                q = heads[~seen[heads]]
             else:
-                #if the node is in the output dictionary, store it's count
-                #as the length of its input node list
-                count_dict[n] = len(in_dict[n][0])
-        #iterate through all nodes in the input dictionary
-        for n in in_dict:
-            # if the node is not in the count dictionary,
-            if n not in count_dict:
-                #store its count as the length of the input node list
-                count_dict[n] = len(in_dict[n][0])
-        return count_dict
-
-    def makeTopOrd(self, count_dict, out_dict):
-        '''
-        Returns a list of the topological order of the graph determined using
-        Kahn's algorithm
-        '''
-        q = []
-        top_ord = []
-        #iterate through the count dict to find all the nodes with 0 inputs
-        for n in count_dict:
-            if count_dict[n] == 0:
-                #appending all of these nodes to our queue list (q)
-                q.append(n)
-        #while there are still items in the queue,
-        while len(q) > 0:
-            #we remove one of the nodes in the queue
-            j = q.pop()
-            #append it to our topological order list
-            top_ord.append(j)
-            #iterate through all the output nodes for our selected node
-            for i in out_dict[j][0]:
-                #subtract one from the count dictionary for the output node
-                count_dict[i] += -1
-                #check if the output node now has a count of 0
-                if count_dict[i] == 0:
-                    #add it to the queue
-                    q.append(i)
-        return top_ord
-
-
-    def calcScore(self, node, in_dict, score_dict):
-        '''
-        calculates the score for a node and adds it to the score dictionary
-        if it is better than the exisiting score
-        '''
-        #checking if the node has an input
-        if len(in_dict[node][0]) != 0:
-            #iterate through the length of the values in the in_dict for a node
-            for i in range(len(in_dict[node][0])):
-                #-------------------------------------------------------------
-                #all of these variables are defined in order to make the logic
-                #of the code more easily understood without having to look up
-                #the structure of the dictionaries
-                #-------------------------------------------------------------
-                #the ith in_node for our node
-                in_node = in_dict[node][0][i]
-                #the ith weight of our in_node
-                in_wt = in_dict[node][1][i]
-                #the score of our ith in_node
-                in_score = score_dict[in_node][0]
-                #the ith in_node's score's path
-                # in_path = score_dict[in_node][1]
-                #the new score for our node
-                new_score = in_score + in_wt
-                #checking if our new score is better than the existing score in
-                #the score dictionary
-                if score_dict[node][0] < new_score:
-                    new_path = in_node
-                    score_dict[node] = [new_score, in_node]
-        return score_dict
+                q = heads[~seen[heads] & within[heads]]
+            seen[q] = True
+            if len(q) > 1:
+                q = np.unique(q)
+        return seen
+
+    def relevantNodes(self, source, sinks):
+        '''
+        returns a boolean array that is True for the nodes on some path from
+        the source to one of the sinks: the nodes the source reaches that
+        reach a sink along the edges reversed
+        '''
+        forward = self.reach(np.array([source]), self.offsets, self.targets)
+        sinks = np.asarray(sinks, dtype=np.int64)
+        sinks = sinks[forward[sinks]]
+        if not len(sinks):
+            return np.zeros(len(self.labels), dtype=bool)
+        if self.inOffsets is not None:
+            return self.reach(sinks, self.inOffsets, self.inTails, forward)
+        #group the edges out of the forward nodes by the node they enter
+        edges, tails = self.edgesOf(np.flatnonzero(forward))
+        heads = self.targets[edges]
+        order = np.argsort(heads, kind='stable')
+        offsets = np.zeros(len(self.labels) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(heads, minlength=len(self.labels)), out=offsets[1:])
+        backward = self.reach(sinks, offsets, tails[order])
+        return forward & backward
+
+    def sliceEdges(self, relevant):
+        '''
+        returns the index of every edge between relevant nodes, the node each
+        one leaves and the node it enters
+        '''
+        edges, tails = self.edgesOf(np.flatnonzero(relevant))
+        keep = relevant[self.targets[edges]]
+        edges, tails = edges[keep], tails[keep]
+        return edges, tails, self.targets[edges]
+
+    def queues(self, source, relevant, heads):
+        '''
+        Runs Kahn's algorithm from the source over the edges between relevant
+        nodes, whose heads are given, a whole queue of nodes at a time. yields
+        each queue with the index, tail and head of its output edges: when a
+        queue is dequeued all of its nodes' inputs are done, so the caller
+        can pass their final scores along those edges in the same step that
+        removes the edges from the input counts of the output nodes. a queue
+        of at most smallQueue nodes is yielded with lists instead of arrays
+        '''
+        #how many inputs each node has among the relevant edges
+        count = np.bincount(heads, minlength=len(self.labels))
+        if count[source]:
+            #an input of the source closes a cycle through it, and dequeuing
+            #its last input would queue it again
+            raise ValueError('the graph has a cycle between the source and sink')
+        q = np.array([source], dtype=np.int64)
+        done = 0
+        while len(q):
+            done += len(q)
+            if len(q) <= self.smallQueue:
+                q = q if isinstance(q, list) else q.tolist()
+                out, outTails, outHeads = [], [], []
+                for node in q:
+                    for edge in range(self.offsets.item(node), self.offsets.item(node + 1)):
+                        head = self.targets.item(edge)
+                        if relevant.item(head):
+                            out.append(edge)
+                            outTails.append(node)
+                            outHeads.append(head)
+                yield q, out, outTails, outHeads
+                #a node's count reaches zero once, so it is queued once
+                found = []
+                for head in outHeads:
+                    left = count.item(head) - 1
+                    count[head] = left
+                    if not left:
+                        found.append(head)
+                q = found if len(found) <= self.smallQueue else np.array(found, dtype=np.int64)
+                continue
+            out, outTails = self.edgesOf(q)
+            outHeads = self.targets[out]
+            keep = relevant[outHeads]
+            out, outTails, outHeads = out[keep], outTails[keep], outHeads[keep]
+            yield q, out, outTails, outHeads
+            np.subtract.at(count, outHeads, 1)
+            q = outHeads[count[outHeads] == 0]
+            if len(q) > 1:
+                #a node can be the output of more than one edge
+                q = np.unique(q)
+        if done < relevant.sum():
+            raise ValueError('the graph has a cycle between the source and sink')
+
+    def sweep(self, source, relevant):
+        '''
+        Returns the score of every node from the source and the input node
+        each one takes it from (-1 for none), passing the scores along the
+        edges between relevant nodes as Kahn's algorithm dequeues them
+        '''
+        n = len(self.labels)
+        #all nodes start with a lower score than our specified source node
+        score = np.full(n, self.unreached, dtype=np.int64)
+        score[source] = 0
+        edges, tails, heads = self.sliceEdges(relevant)
+        for q, out, outTails, outHeads in self.queues(source, relevant, heads):
+            if isinstance(out, list):
+                for edge, tail, head in zip(out, outTails, outHeads):
+                    passed = score.item(tail) + self.weights.item(edge)
+                    if passed > score.item(head):
+                        score[head] = passed
+                continue
+            np.maximum.at(score, outHeads, score[outTails] + self.weights[out])
+        #the input node of each node is the first input edge (in the order
+        #the input lists them) that gives it its score
+        best = np.flatnonzero(score[tails] + self.weights[edges] == score[heads])
+        key = edges[best] if self.edgeOrder is None else self.edgeOrder[edges[best]]
+        first = np.full(n, np.iinfo(np.int64).max, dtype=np.int64)
+        np.minimum.at(first, heads[best], key)
+        best = best[key == first[heads[best]]]
+        in_node = np.full(n, -1, dtype=np.int64)
+        in_node[heads[best]] = tails[best]
+        return score, in_node
+
+    def topSweep(self, source, relevant, k):
+        '''
+        Returns the k best paths from the source to every relevant node as
+        three arrays with a row of k entries per relevant node (in order of
+        node id): the score of each path, the entry of the path it extends
+        (row * k + column, -1 for the source's own path) and how many
+        entries each row holds. a dequeued node's entries are final, so they
+        are extended along its output edges and merged into the best k
+        entries of each output node
+        '''
+        slot = np.cumsum(relevant, dtype=np.int64) - 1
+        rows = int(relevant.sum())
+        topScore = np.zeros((rows, k), dtype=np.int64)
+        topFrom = np.full((rows, k), -1, dtype=np.int64)
+        filled = np.zeros(rows, dtype=np.int64)
+        filled[slot[source]] = 1
+        edges, tails, heads = self.sliceEdges(relevant)
+        for q, out, outTails, outHeads in self.queues(source, relevant, heads):
+            if isinstance(out, list):
+                #a small queue merges one edge at a time, keeping the entries
+                #a node holds ahead of new ones with the same score
+                for edge, tail, head in zip(out, outTails, outHeads):
+                    tailRow, headRow = slot.item(tail), slot.item(head)
+                    size, held = filled.item(tailRow), filled.item(headRow)
+                    weight = self.weights.item(edge)
+                    if not held:
+                        #an edge into an empty node, as along a chain,
+                        #copies the entries of the node it leaves
+                        topScore[headRow, :size] = topScore[tailRow, :size] + weight
+                        topFrom[headRow, :size] = tailRow*k + np.arange(size)
+                        filled[headRow] = size
+                        continue
+                    entries = list(zip(topScore[headRow, :held].tolist(), topFrom[headRow, :held].tolist()))
+                    entries += [(passed + weight, tailRow*k + column) for column, passed in enumerate(topScore[tailRow, :size].tolist())]
+                    entries.sort(key=lambda entry: -entry[0])
+                    del entries[k:]
+                    topScore[headRow, :len(entries)] = [entry[0] for entry in entries]
+                    topFrom[headRow, :len(entries)] = [entry[1] for entry in entries]
+                    filled[headRow] = len(entries)
+                continue
+            if not len(out):
+                continue
+            #one candidate for each entry of the node each edge leaves
+            tailRows = slot[outTails]
+            counts = filled[tailRows]
+            edge = np.repeat(np.arange(len(out)), counts)
+            column = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            tailRows = tailRows[edge]
+            newRows = slot[outHeads][edge]
+            newScore = topScore[tailRows, column] + self.weights[out][edge]
+            newFrom = tailRows*k + column
+            #with the entries the output nodes already hold
+            headRows = np.unique(newRows)
+            counts = filled[headRows]
+            oldRows = np.repeat(headRows, counts)
+            column = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            allRows = np.concatenate((oldRows, newRows))
+            allScore = np.concatenate((topScore[oldRows, column], newScore))
+            allFrom = np.concatenate((topFrom[oldRows, column], newFrom))
+            #keep the best k of each output node
+            order = np.lexsort((-allScore, allRows))
+            allRows, allScore, allFrom = allRows[order], allScore[order], allFrom[order]
+            starts = np.flatnonzero(np.concatenate(([True], allRows[1:] != allRows[:-1])))
+            sizes = np.diff(np.append(starts, len(allRows)))
+            rank = np.arange(len(allRows)) - np.repeat(starts, sizes)
+            keep = rank < k
+            topScore[allRows[keep], rank[keep]] = allScore[keep]
+            topFrom[allRows[keep], rank[keep]] = allFrom[keep]
+            filled[allRows[starts]] = np.minimum(sizes, k)
+        return topScore, topFrom, filled
+
+    def findTopPaths(self, k):
+        '''
+        Returns the score and path of each of the k longest paths from the
+        source to the sink, best first. fewer are returned when there are
+        fewer paths, and none when the source cannot reach the sink
+        '''
+        source = self.nodeId(self.i_node)
+        sink = self.nodeId(self.o_node)
+        relevant = self.relevantNodes(source, [sink])
+        if not relevant[sink]:
+            return []
+        topScore, topFrom, filled = self.topSweep(source, relevant, k)
+        nodes = np.flatnonzero(relevant)
+        row = int(np.searchsorted(nodes, sink))
+        paths = []
+        for column in range(filled[row]):
+            #follow the entries each path extends back to the source
+            entry = row*k + column
+            path = []
+            while entry != -1:
+                path.append(int(nodes[entry // k]))
+                entry = int(topFrom.flat[entry])
+            path.reverse()
+            paths.append((int(topScore[row, column]), [self.labelText(n) for n in path]))
+        return paths
+
+    def sourcePaths(self, source, sinks):
+        '''
+        returns the score and path (as node ids) of the longest path from the
+        source to each of the sinks, from one sweep of the nodes on a path to
+        any of them. a sink the source cannot reach gets the unreached score
+        and a path of just the sink
+        '''
+        relevant = self.relevantNodes(source, sinks)
+        if not relevant.any():
+            return [(self.unreached, [sink]) for sink in sinks]
+        score, in_node = self.sweep(source, relevant)
+        paths = []
+        for sink in sinks:
+            if not relevant[sink]:
+                paths.append((self.unreached, [sink]))
+                continue
+            #defines the path of the longest path, back from the sink
+            path = [sink]
+            while path[-1] != source:
+                path.append(int(in_node[path[-1]]))
+            path.reverse()
+            paths.append((int(score[sink]), path))
+        return paths
 
     def findLongestPath(self):
         '''
-        Iterates through the topological order of our graph and calculates
-        the score for each node. Then it returns the score and path of the
+        Calculates the score for each node on a path from the source to the
+        sink in topological order. Then it returns the score and path of the
         longest path for our sink node
         '''
-        out_dict, in_dict = self.makeIODicts()
-        count_dict = self.makeCountDict(out_dict, in_dict)
-        top_ord = self.makeTopOrd(count_dict, out_dict)
-        score_dict = self.makeScoreDict(out_dict, in_dict)
-        node = self.o_node
-        path= [self.o_node]
-        i=0
-        for n in top_ord:
-            i+=1
-            score_dict = self.calcScore(n, in_dict, score_dict)
-        #defines the score of the longest path for our sink node
-        score = score_dict[self.o_node][0]
-        #defines the path of the longest path
+        score, path = self.sourcePaths(self.nodeId(self.i_node), [self.nodeId(self.o_node)])[0]
+        return score, [self.labelText(n) for n in path]
 
-        while len(score_dict[node][1]) != 0:
-            path.append(score_dict[node][1])
-            node = score_dict[node][1]
-        path.reverse()
+    def findLongestPaths(self, queries, workers=1):
+        '''
+        Returns the score and path of the longest path for each (source,
+        sink) pair of labels in queries, in order. the edges into each node
+        are grouped once for all the queries, and the queries that share a
+        source are answered together by one sweep from it. the sources are
+        shared among a pool of worker processes when workers is more than 1
+        '''
+        queries = [(self.nodeId(i_node), self.nodeId(o_node)) for i_node, o_node in queries]
+        if self.inOffsets is None:
+            self.makeReverse()
+        groups = {}
+        for i, (source, sink) in enumerate(queries):
+            groups.setdefault(source, []).append(i)
+        tasks = [(source, [queries[i][1] for i in group]) for source, group in groups.items()]
+        if workers <= 1 or len(tasks) < 2:
+            results = [self.sourcePaths(source, sinks) for source, sinks in tasks]
+        else:
+            import multiprocessing
+            with multiprocessing.Pool(min(workers, len(tasks)), initializer=queryWorkerSetup, initargs=(self,)) as pool:
+                results = pool.map(queryWorker, tasks, chunksize=max(len(tasks) // (4*workers), 1))
+        answers = [None] * len(queries)
+        for group, paths in zip(groups.values(), results):
+            for i, (score, path) in zip(group, paths):
+                answers[i] = (score, [self.labelText(n) for n in path])
+        return answers
 
-        return score, path
 
+def queryWorkerSetup(longestPath):
+    '''
+    keeps the LongestPath of a query worker
+    '''
+    global queryGraph
+    queryGraph = longestPath
+
+
+def queryWorker(task):
+    '''
+    answers the queries of one source in a worker process
+    '''
+    source, sinks = task
+    return queryGraph.sourcePaths(source, sinks)
 
 
+def readQueries(fname):
+    '''
+    returns the (source, sink) pair on each line of a queries file, the two
+    labels separated by whitespace
+    '''
+    queries = []
+    with open(fname) as fileH:
+        for line in fileH:
+            fields = line.split()
+            if not fields:
+                continue
+            if len(fields) != 2:
+                raise Usage('query lines need a source and a sink: {0}'.format(line.strip()))
+            queries.append((fields[0], fields[1]))
+    return queries
 
 
-def main():
-    i_node = sys.stdin.readline().strip()
-    o_node = sys.stdin.readline().strip()
-    data = [d.strip() for d in sys.stdin.readlines()]
+class CommandLine() :
+    '''
+    Handle the command line, usage and help requests.
+
+    CommandLine uses argparse, now standard in 2.7 and beyond.
+    it implements a standard command line argument parser with various argument options,
+    a standard usage and help, and an error termination mechanism do-usage_and_die.
 
-    longest_path = LongestPath(data, i_node, o_node)
+    attributes:
+    all arguments received from the commandline using .add_argument will be
+    avalable within the .args attribute of object instantiated from CommandLine.
+    For example, if myCommandLine is an object of the class, and requiredbool was
+    set as an option using add_argument, then myCommandLine.args.requiredbool will
+    name that option.
+
+    '''
+
+    def __init__(self, inOpts=None) :
+        '''
+        CommandLine constructor.
+
+        Implements a parser to interpret the command line argv string using argparse.
+        '''
+
+        import argparse
+        self.parser = argparse.ArgumentParser(description = 'Program prolog - finds the longest path through a weighted directed graph',
+                                             epilog = 'Program epilog - edge lines look like node->out node:weight',
+                                             add_help = True,
+                                             prefix_chars = '-',
+                                             usage = '%(prog)s [options] <graphfile >txtfile'
+                                             )
+        self.parser.add_argument('-g', '--graph', action = 'store', default = '', help='graph file to read instead of stdin')
+        self.parser.add_argument('-b', '--binary', action = 'store_true', default = False, help='the graph is a file of int64 (node, out node, weight) triples')
+        self.parser.add_argument('-s', '--source', action = 'store', help='source node, replaces the first line of a text graph')
+        self.parser.add_argument('-t', '--sink', action = 'store', help='sink node, replaces the second line of a text graph')
+        self.parser.add_argument('-q', '--queries', action = 'store', help='file of source and sink pairs to answer instead of one path')
+        self.parser.add_argument('-k', '--top', type = int, action = 'store', help='report the TOP longest paths instead of one')
+        self.parser.add_argument('-w', '--workers', type = int, action = 'store', default = 1, help='worker processes answering the queries')
+        if inOpts is None :
+            self.args = self.parser.parse_args()
+        else :
+            self.args = self.parser.parse_args(inOpts)
+
+
+class Usage(Exception):
+    '''
+    Used to signal a Usage error, evoking a usage statement and
+    eventual exit when raised.
+    '''
+    def __init__(self, msg):
+        self.msg = msg
+
+
+def main(myCommandLine=None):
+    '''
+    Implement the Usage exception handler that can be raised from anywhere
+    in process.
+
+    '''
+    if myCommandLine is None:
+        myCommandLine = CommandLine()  # read options from the command line
+    else :
+        myCommandLine = CommandLine(myCommandLine) # interpret the list passed from the caller of main as the commandline.
+
+    try:
+        if myCommandLine.args.workers < 1:
+            raise Usage('the number of workers must be at least 1')
+        if myCommandLine.args.top is not None and myCommandLine.args.top < 1:
+            raise Usage('the number of paths (-k) must be at least 1')
+        if myCommandLine.args.top is not None and myCommandLine.args.queries is not None:
+            raise Usage('the longest paths (-k) are found for a single source and sink, not queries (-q)')
+        queries = None
+        if myCommandLine.args.queries is not None:
+            queries = readQueries(myCommandLine.args.queries)
+        elif myCommandLine.args.binary and (myCommandLine.args.source is None or myCommandLine.args.sink is None):
+            raise Usage('a binary graph needs the source (-s) and sink (-t) nodes')
+        try:
+            i_node, o_node, sources, targets, weights = EdgeReader(myCommandLine.args.graph, myCommandLine.args.binary).readGraph()
+        except ValueError as err:
+            raise Usage(str(err))
+        if myCommandLine.args.source is not None:
+            i_node = myCommandLine.args.source
+        if myCommandLine.args.sink is not None:
+            o_node = myCommandLine.args.sink
+
+        longest_path = LongestPath(None, i_node, o_node, (sources, targets, weights))
+
+        try:
+            if queries is not None:
+                answers = longest_path.findLongestPaths(queries, myCommandLine.args.workers)
+            elif myCommandLine.args.top is not None:
+                answers = longest_path.findTopPaths(myCommandLine.args.top)
+            else:
+                score, path = longest_path.findLongestPath()
+        except KeyError as err:
+            raise Usage('node {0} is not in the graph'.format(err.args[0]))
+        except ValueError as err:
+            raise Usage(str(err))
 
-    score, path = longest_path.findLongestPath()
+        if queries is not None:
+            #one line per query: source, sink, score and path
+            for (i_node, o_node), (score, path) in zip(queries, answers):
+                print('{0}\t{1}\t{2}\t{3}'.format(i_node, o_node, score, "->".join(path)))
+        elif myCommandLine.args.top is not None:
+            #the score and path of each path, best first
+            for score, path in answers:
+                print(score)
+                print("->".join(path))
+        else:
+            print(score)
+            print("->".join(path))
 
-    print(score)
-    print("->".join(path))
+    except Usage as err:
+       print (err.msg)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+import random
+import time
+from randomizedMotifSearch import FindMotif, Usage, makeReader
+
+'''
+This program compares the search engines of randomizedMotifSearch.py by the
+time, restarts and window evaluations each one needs to find a motif matrix
+with an entropy at or below a target.
+
+Input:
+The same fasta input as randomizedMotifSearch.py, plus the target entropy.
+
+The command line argument should follow the format:
+benchmarkEngines.py -p=1 -k=13 -t=9.9 -s=1 -l=60 <somefile.fa
+
+where p is the number of psuedocounts, k is the motif length, t is the target
+entropy, s is the seed of the restarts and l is the most seconds given to each
+engine. -n sets the steps of each Gibbs sampling restart.
+
+Output:
+One line per engine with the restarts, window evaluations and seconds it took
+to reach the target (or the time limit), its best entropy and motif:
+engine    restarts     windows  seconds  entropy  motif
+greedy          50     6381120     0.35     9.74  GATTACAGCT
+gibbs           13     2017560     0.24     9.74  GATTACAGCT
+
+'''
+
+class CommandLine() :
+    '''
+    Handle the command line, usage and help requests.
+
+    CommandLine uses argparse, now standard in 2.7 and beyond.
+    it implements a standard command line argument parser with various argument options,
+    a standard usage and help, and an error termination mechanism do-usage_and_die.
+
+    attributes:
+    all arguments received from the commandline using .add_argument will be
+    avalable within the .args attribute of object instantiated from CommandLine.
+    For example, if myCommandLine is an object of the class, and requiredbool was
+    set as an option using add_argument, then myCommandLine.args.requiredbool will
+    name that option.
+
+    '''
+
+    def __init__(self, inOpts=None) :
+        '''
+        CommandLine constructor.
+
+        Implements a parser to interpret the command line argv string using argparse.
+        '''
+
+        import argparse
+        self.parser = argparse.ArgumentParser(description = 'Program prolog - reads in a fasta file',
+                                             epilog = 'Program epilog - file must begin with a carrot (>)',
+                                             add_help = True,
+                                             prefix_chars = '-',
+                                             usage = '%(prog)s [p, k, t] -pseudoCounts[null] -motifLength[null] -target[null] <fastafile >txtfile'
+                                             )
+        self.parser.add_argument('-p', '--pseudoCounts', type = int, action = 'store', default = 1, help='pseudocounts')
+        self.parser.add_argument('-k', '--motifLength', type = int, action = 'store', help='the length of the motif')
+        self.parser.add_argument('-t', '--target', type = float, action = 'store', help='the entropy each engine has to reach')
+        self.parser.add_argument('-s', '--seed', type = int, action = 'store', default = 1, help='seed for the random restarts')
+        self.parser.add_argument('-l', '--timeLimit', type = float, action = 'store', default = 60, help='most seconds given to each engine')
+        self.parser.add_argument('-n', '--steps', type = int, action = 'store', help='Gibbs sampling steps per restart')
+        self.parser.add_argument('-f', '--fasta', action = 'store', help='fasta file to read instead of stdin')
+        self.parser.add_argument('-r', '--regions', action = 'store', help='BED file of regions of the fasta file to search')
+        if inOpts is None :
+            self.args = self.parser.parse_args()
+        else :
+            self.args = self.parser.parse_args(inOpts)
+
+
+def timeToTarget(ourMotif, engine, target, seed, timeLimit):
+    '''
+    runs restarts of one engine until the best entropy is at or below the
+    target or the time limit passes. returns the restarts, window
+    evaluations, seconds, best entropy and best motif
+    '''
+    ourMotif.engine = engine
+    ourMotif.rng = random.Random(seed)
+    ourMotif.windowEvaluations = 0
+    restarts = 0
+    start = time.perf_counter()
+    winner, winnerKmer = float('inf'), ''
+    while winner > target and time.perf_counter() - start < timeLimit:
+        [(consensusMotif, entropy, counts)], run = ourMotif.runRestarts(1)
+        restarts += 1
+        if entropy < winner:
+            winner, winnerKmer = entropy, consensusMotif
+    return restarts, ourMotif.windowEvaluations, time.perf_counter() - start, winner, winnerKmer
+
+
+def main(myCommandLine=None):
+    '''
+    Implement the Usage exception handler that can be raised from anywhere
+    in process.
+
+    '''
+    if myCommandLine is None:
+        myCommandLine = CommandLine()  # read options from the command line
+    else :
+        myCommandLine = CommandLine(myCommandLine) # interpret the list passed from the caller of main as the commandline.
+
+    try:
+        if myCommandLine.args.motifLength is None or myCommandLine.args.target is None:
+            raise Usage('the motif length (-k) and target entropy (-t) are needed')
+        reader = makeReader(myCommandLine.args.fasta, myCommandLine.args.regions)
+        ourMotif = FindMotif(0, myCommandLine.args.motifLength, myCommandLine.args.pseudoCounts, reader, steps=myCommandLine.args.steps)
+        reader.close()
+
+        print('{0:8}{1:>10}{2:>12}{3:>9}{4:>9}  {5}'.format('engine', 'restarts', 'windows', 'seconds', 'entropy', 'motif'))
+        for engine in ('greedy', 'gibbs'):
+            restarts, windows, seconds, entropy, motif = timeToTarget(ourMotif, engine, myCommandLine.args.target, myCommandLine.args.seed, myCommandLine.args.timeLimit)
+            print('{0:8}{1:>10}{2:>12}{3:>9.2f}{4:>9.2f}  {5}'.format(engine, restarts, windows, seconds, entropy, motif))
+
+    except Usage as err:
+       print (err.msg)
+
+if __name__ == "__main__":
+    main()
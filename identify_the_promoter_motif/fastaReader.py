@@ -1,39 +1,281 @@
 import sys
 class FastAreader :
-	
-    def __init__ (self, fname=''):
+    '''
+    Reads a fasta file one record at a time.
+
+    The file is read in large binary blocks and the sequence lines of each
+    record are collected in a list that is joined once per record, so reading
+    a chromosome sized record costs time linear in its length.
+
+    Attributes:
+        fname = the fasta file to read, stdin is used when it is empty
+        blockSize = the number of bytes read from the file at a time
+    '''
+    #bytes removed from sequence lines (whitespace) and the table used to
+    #uppercase the bases while they are removed
+    whitespace = b' \t\n\r\x0b\x0c'
+    upperTable = bytes.maketrans(b'abcdefghijklmnopqrstuvwxyz',
+                                 b'ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+
+    def __init__ (self, fname='', blockSize=1 << 22):
         '''contructor: saves attribute fname '''
         self.fname = fname
-            
+        self.blockSize = blockSize
+
     def doOpen (self):
-        if self.fname is '':
-            return sys.stdin
+        '''
+        opens the fasta file in binary mode
+        '''
+        if self.fname == '':
+            return sys.stdin.buffer
         else:
-            return open(self.fname)
- 
-    def readFasta (self):
-		
-        header = ''
-        sequence = ''
-        
+            return open(self.fname, 'rb')
+
+    def readLines (self, fileH):
+        '''
+        yields blocks of complete lines from the file. a line longer than a
+        block is collected in a list until its end is found
+        '''
+        pending = []
+        while True:
+            block = fileH.read(self.blockSize)
+            if not block:
+                break
+            end = block.rfind(b'\n')
+            if end < 0:
+                pending.append(block)
+                continue
+            if pending:
+                pending.append(block[:end+1])
+                yield b''.join(pending)
+                pending = []
+            else:
+                yield block[:end+1]
+            if end + 1 < len(block):
+                pending.append(block[end+1:])
+        if pending:
+            yield b''.join(pending) + b'\n'
+
+    def readFasta (self, asBytes=False):
+        '''
+        yields the header and sequence of each record in the file. the
+        sequence is uppercased with all whitespace removed and is returned
+        as bytes when asBytes is True
+        '''
+        header = None
+        pieces = []
+
         with self.doOpen() as fileH:
-			
-            header = ''
-            sequence = ''
- 
-            # skip to first fasta header
-            line = fileH.readline()
-            while not line.startswith('>') :
-                line = fileH.readline()
-            header = line[1:].rstrip()
-
-            for line in fileH:
-                if line.startswith ('>'):
-                    yield header,sequence
-                    header = line[1:].rstrip()
-                    sequence = ''
-                else :
-                    sequence += ''.join(line.rstrip().split()).upper()
-						
-        yield header,sequence
+            for block in self.readLines(fileH):
+                start = 0
+                while start < len(block):
+                    #find the next header line in this block
+                    if block.startswith(b'>', start):
+                        mark = start
+                    else:
+                        mark = block.find(b'\n>', start)
+                        if mark < 0:
+                            mark = len(block)
+                        else:
+                            mark += 1
+                    #everything before the header belongs to the current
+                    #record. lines before the first header are skipped
+                    if header is not None and mark > start:
+                        pieces.append(block[start:mark].translate(self.upperTable, self.whitespace))
+                    if mark == len(block):
+                        break
+                    if header is not None:
+                        yield self.makeRecord(header, pieces, asBytes)
+                    end = block.index(b'\n', mark)
+                    header = block[mark+1:end].rstrip()
+                    pieces = []
+                    start = end + 1
+
+        if header is not None:
+            yield self.makeRecord(header, pieces, asBytes)
+
+    def makeRecord (self, header, pieces, asBytes):
+        '''
+        joins the sequence pieces of a record and decodes the record
+        '''
+        sequence = b''.join(pieces)
+        if not asBytes:
+            sequence = sequence.decode('latin-1')
+        return header.decode('utf-8', 'replace'), sequence
+
+    def close (self):
+        '''
+        the file is closed after each reading, kept so the reader can stand
+        in for a FastaIndex
+        '''
+        pass
+
+
+class FastaIndex :
+    '''
+    Random access to the records of a fasta file through a .fai style index.
+
+    The index holds one line per record with its name, length, the byte
+    offset of its first base, the number of bases per line and the number of
+    bytes per line (the same columns samtools faidx writes). The fasta file is
+    memory mapped, so fetching record[start:end] only touches the lines that
+    hold those bases.
+
+    Attributes:
+        fname = the fasta file, which must be a file rather than stdin
+        indexName = the sidecar index file (fname + '.fai')
+        regions = (name, start, end) tuples yielded by readFasta, every record
+                  is yielded when it is None
+        records = a dictionary of record names and their index entries
+        names = the record names in file order
+    '''
+    def __init__ (self, fname, regions=None):
+        import os
+        self.fname = fname
+        self.indexName = fname + '.fai'
+        self.regions = regions
+        self.records = {}
+        self.names = []
+        if not os.path.exists(self.indexName) or os.path.getmtime(self.indexName) < os.path.getmtime(fname):
+            self.buildIndex()
+        self.readIndex()
+        self.fileH = open(fname, 'rb')
+        self.mm = None
+        if os.path.getsize(fname) > 0:
+            import mmap
+            self.mm = mmap.mmap(self.fileH.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def buildIndex (self):
+        '''
+        scans the fasta file once and writes the index. every line of a
+        record except its last must have the same length
+        '''
+        import mmap
+        entries = []
+        with open(self.fname, 'rb') as fileH:
+            try:
+                mm = mmap.mmap(fileH.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                #an empty file cannot be mapped and has no records
+                mm = b''
+            size = len(mm)
+            pos = 0 if mm[:1] == b'>' else mm.find(b'\n>')
+            if pos > 0:
+                pos += 1
+            while 0 <= pos < size:
+                headerEnd = mm.find(b'\n', pos)
+                if headerEnd < 0:
+                    headerEnd = size
+                name = mm[pos+1:headerEnd].split(None, 1)
+                name = name[0].decode('utf-8', 'replace') if name else ''
+                offset = min(headerEnd + 1, size)
+                nextHeader = mm.find(b'\n>', headerEnd)
+                end = size if nextHeader < 0 else nextHeader + 1
+                length, lineBases, lineWidth = self.measureRecord(mm, offset, end, name)
+                entries.append((name, length, offset, lineBases, lineWidth))
+                pos = end
+            if size:
+                mm.close()
+        with open(self.indexName, 'w') as indexH:
+            for entry in entries:
+                indexH.write('\t'.join(str(x) for x in entry) + '\n')
+
+    def measureRecord (self, mm, offset, end, name):
+        '''
+        returns the length, bases per line and bytes per line of the record
+        whose sequence lines span mm[offset:end]. blank lines at the end of
+        the record are left out, as samtools faidx allows them
+        '''
+        last = end
+        while end > offset and mm[end-1:end] in (b'\n', b'\r', b' ', b'\t'):
+            end -= 1
+        #keep the line end of the last line of bases
+        lineEnd = mm.find(b'\n', end, last)
+        if lineEnd >= 0:
+            end = lineEnd + 1
+        if offset >= end:
+            return 0, 0, 0
+        lineEnd = mm.find(b'\n', offset, end)
+        if lineEnd < 0:
+            lineEnd = end - 1
+        lineWidth = lineEnd - offset + 1
+        lineBases = len(mm[offset:lineEnd].rstrip())
+        #count the line breaks in slices so huge records are not copied at once
+        newlines = 0
+        for chunk in range(offset, end, 1 << 26):
+            newlines += mm[chunk:min(chunk + (1 << 26), end)].count(b'\n')
+        if mm[end-1:end] != b'\n':
+            newlines += 1
+        regionBytes = end - offset + (1 if mm[end-1:end] != b'\n' else 0)
+        #the bytes of a record with uniform lines are its bases plus
+        #(lineWidth - lineBases) line end bytes on each line
+        length = regionBytes - newlines * (lineWidth - lineBases)
+        lastStart = mm.rfind(b'\n', offset, end - 1) + 1
+        lastLine = mm[max(lastStart, offset):end].rstrip()
+        if lineBases == 0 or -(-length // lineBases) != newlines or len(lastLine) != length - (newlines - 1) * lineBases:
+            raise ValueError('record {0} in {1} does not have lines of equal length'.format(name, self.fname))
+        return length, lineBases, lineWidth
+
+    def readIndex (self):
+        '''
+        reads the index file into the records dictionary
+        '''
+        with open(self.indexName) as indexH:
+            for line in indexH:
+                name, length, offset, lineBases, lineWidth = line.rstrip('\n').split('\t')
+                self.records[name] = (int(length), int(offset), int(lineBases), int(lineWidth))
+                self.names.append(name)
+
+    def fetch (self, name, start=0, end=None, asBytes=False):
+        '''
+        returns record[start:end] for the named record, uppercased, as a string
+        or as bytes when asBytes is True
+        '''
+        length, offset, lineBases, lineWidth = self.records[name]
+        if end is None or end > length:
+            end = length
+        start = max(0, start)
+        if start >= end:
+            sequence = b''
+        else:
+            first = offset + (start // lineBases) * lineWidth + start % lineBases
+            last = offset + ((end - 1) // lineBases) * lineWidth + (end - 1) % lineBases + 1
+            sequence = self.mm[first:last].translate(FastAreader.upperTable, FastAreader.whitespace)
+        if not asBytes:
+            sequence = sequence.decode('latin-1')
+        return sequence
+
+    def readFasta (self, asBytes=False):
+        '''
+        yields the header and sequence of each region, or of every record when
+        no regions were given, so the index can stand in for a FastAreader
+        '''
+        if self.regions is None:
+            for name in self.names:
+                yield name, self.fetch(name, asBytes=asBytes)
+        else:
+            for name, start, end in self.regions:
+                yield '{0}:{1}-{2}'.format(name, start, end), self.fetch(name, start, end, asBytes)
+
+    def close (self):
+        '''
+        releases the memory map and the file
+        '''
+        if self.mm is not None:
+            self.mm.close()
+        self.fileH.close()
+
 
+def readRegions (fname):
+    '''
+    reads a BED style file of regions (name, 0 based start, end) and returns
+    them as a list of tuples
+    '''
+    regions = []
+    with open(fname) as regionH:
+        for line in regionH:
+            fields = line.split()
+            if not fields or fields[0].startswith('#') or fields[0] in ('track', 'browser'):
+                continue
+            regions.append((fields[0], int(fields[1]), int(fields[2])))
+    return regions
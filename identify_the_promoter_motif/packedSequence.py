@@ -0,0 +1,222 @@
+import numpy as np
+
+'''
+Compact 2 bit per base storage for DNA sequences.
+
+Bases are coded A=0, C=1, G=2, T=3 so the integer order of k-mer codes is the
+alphabetical order of the k-mers and the complement of a code is 3 - code.
+Four bases are packed into each byte. Any other character (N, IUPAC codes,
+gaps) is stored as A with its position recorded in a list of masked runs, so
+a sequence with long runs of N costs almost nothing extra. Unpacked, such a
+character is coded 4, and a k-mer of up to 32 bases is held 2 bits per base
+in one 64 bit integer code.
+'''
+
+#lookup table from a byte to its base code, 4 marks anything that is not ACGT
+baseCodes = np.full(256, 4, dtype=np.uint8)
+for code, base in enumerate(b'ACGT'):
+    baseCodes[base] = code
+    baseCodes[base + 32] = code
+bases = 'ACGT'
+
+
+def encodeBases(seq):
+    '''
+    returns an array with the code (0-3) of each base of a string or bytes
+    sequence and 4 for every other character
+    '''
+    if isinstance(seq, str):
+        seq = seq.encode('latin-1')
+    return baseCodes[np.frombuffer(seq, dtype=np.uint8)]
+
+
+def encodeKmer(kmer):
+    '''
+    returns the integer code of an ACGT kmer
+    '''
+    code = 0
+    for base in kmer:
+        code = (code << 2) | bases.index(base.upper())
+    return code
+
+
+def decodeKmer(code, k):
+    '''
+    returns the kmer of length k for an integer code
+    '''
+    kmer = []
+    for i in range(k):
+        kmer.append(bases[(int(code) >> (2*(k - 1 - i))) & 3])
+    return ''.join(kmer)
+
+
+def decodeKmers(codes, k):
+    '''
+    returns the kmers of length k for an array of integer codes
+    '''
+    codes = np.asarray(codes, dtype=np.uint64)
+    letters = np.empty((len(codes), k), dtype=np.uint8)
+    lookup = np.frombuffer(b'ACGT', dtype=np.uint8)
+    for i in range(k):
+        letters[:, i] = lookup[(codes >> np.uint64(2*(k - 1 - i))) & np.uint64(3)]
+    return letters.view('S{0}'.format(k)).ravel().astype(str) if k else np.array([''] * len(codes))
+
+
+def reverseComplementCodes(codes, k):
+    '''
+    returns the codes of the reverse complements of an array of kmer codes
+    of length k
+    '''
+    codes = np.asarray(codes, dtype=np.uint64)
+    if k == 0:
+        return np.zeros_like(codes)
+    #reverse the order of the 2 bit bases within the 64 bit word by swapping
+    #neighbouring bases, then base pairs, then bytes, complement them all and
+    #shift the kmer back down to the low bits
+    rc = ((codes >> np.uint64(2)) & np.uint64(0x3333333333333333)) | ((codes & np.uint64(0x3333333333333333)) << np.uint64(2))
+    rc = ((rc >> np.uint64(4)) & np.uint64(0x0F0F0F0F0F0F0F0F)) | ((rc & np.uint64(0x0F0F0F0F0F0F0F0F)) << np.uint64(4))
+    rc = ~rc.byteswap()
+    return rc >> np.uint64(64 - 2*k)
+
+
+def windowCodes(codes, k):
+    '''
+    returns the integer code of the kmer of length k starting at every
+    position of an array of base codes that has room for a whole kmer
+    '''
+    windows = max(len(codes) - k + 1, 0)
+    kmerCodes = np.zeros(windows, dtype=np.uint64)
+    for j in range(k):
+        kmerCodes <<= np.uint64(2)
+        kmerCodes |= codes[j:j+windows].astype(np.uint64)
+    return kmerCodes
+
+
+
+class PackedSequence:
+    '''
+    A DNA sequence held at 2 bits per base.
+
+    Attributes:
+        length = the number of bases in the sequence
+        packed = uint8 array holding four base codes per byte, the first base
+                 in the two highest bits
+        maskStarts = start of each run of non-ACGT characters
+        maskEnds = end (exclusive) of each run of non-ACGT characters
+    '''
+    def __init__(self, seq=b'', codes=None):
+        if codes is None:
+            codes = encodeBases(seq)
+        self.length = len(codes)
+        #find the runs of masked (non-ACGT) positions from the edges of the mask
+        masked = np.concatenate(([False], codes > 3, [False]))
+        edges = np.flatnonzero(masked[1:] != masked[:-1])
+        self.maskStarts = edges[0::2]
+        self.maskEnds = edges[1::2]
+        self.packed = self.pack(np.where(codes > 3, 0, codes).astype(np.uint8))
+
+    def pack(self, codes):
+        '''
+        packs an array of base codes four to a byte
+        '''
+        padded = np.zeros(-(-len(codes) // 4) * 4, dtype=np.uint8)
+        padded[:len(codes)] = codes
+        padded = padded.reshape(-1, 4)
+        return (padded[:, 0] << 6) | (padded[:, 1] << 4) | (padded[:, 2] << 2) | padded[:, 3]
+
+    def __len__(self):
+        return self.length
+
+    def __str__(self):
+        return self.decode()
+
+    def codes(self, start=0, end=None):
+        '''
+        returns the base codes (0-3) of sequence[start:end]. masked positions
+        are returned as 0, use mask() to find them
+        '''
+        start, end = self.bounds(start, end)
+        first = start // 4
+        chunk = self.packed[first:-(-end // 4)]
+        codes = np.empty(len(chunk) * 4, dtype=np.uint8)
+        for i in range(4):
+            codes[i::4] = (chunk >> (6 - 2*i)) & 3
+        return codes[start - first*4:end - first*4]
+
+    def maskedCodes(self, start=0, end=None):
+        '''
+        returns the base codes of sequence[start:end] with 4 at the masked
+        positions, the codes encodeBases gives for the original sequence
+        '''
+        codes = self.codes(start, end)
+        codes[self.mask(start, end)] = 4
+        return codes
+
+    def mask(self, start=0, end=None):
+        '''
+        returns a boolean array that is True at the non-ACGT positions of
+        sequence[start:end]
+        '''
+        start, end = self.bounds(start, end)
+        #mark where each run overlapping the slice opens and closes, a running
+        #sum of the marks is then 1 inside the runs
+        first, last = np.searchsorted(self.maskEnds, start, side='right'), np.searchsorted(self.maskStarts, end)
+        marks = np.zeros(end - start + 1, dtype=np.int8)
+        marks[np.maximum(self.maskStarts[first:last], start) - start] += 1
+        marks[np.minimum(self.maskEnds[first:last], end) - start] -= 1
+        return np.cumsum(marks[:-1], dtype=np.int8) > 0
+
+    def segments(self, minLength=1):
+        '''
+        returns the (start, end) of every maximal ACGT-only segment that is at
+        least minLength bases long
+        '''
+        starts = np.concatenate(([0], self.maskEnds))
+        ends = np.concatenate((self.maskStarts, [self.length]))
+        keep = ends - starts >= max(minLength, 1)
+        return list(zip(starts[keep].tolist(), ends[keep].tolist()))
+
+    def kmerCodes(self, k, start=0, end=None):
+        '''
+        returns the integer code of every kmer of length k in
+        sequence[start:end] and a boolean array that is True for the kmers
+        made only of ACGT
+        '''
+        if k > 32:
+            raise ValueError('kmers longer than 32 bases do not fit in 64 bits')
+        codes = self.codes(start, end)
+        kmerCodes = windowCodes(codes, k)
+        masked = np.concatenate(([0], np.cumsum(self.mask(start, end), dtype=np.int64)))
+        valid = masked[k:] == masked[:len(kmerCodes)]
+        return kmerCodes, valid
+
+    def reverseComplement(self):
+        '''
+        returns the reverse complement as a new PackedSequence. masked
+        positions stay masked
+        '''
+        codes = 3 - self.codes()[::-1]
+        codes[self.mask()[::-1]] = 4
+        return PackedSequence(codes=codes)
+
+    def decode(self, start=0, end=None):
+        '''
+        returns sequence[start:end] as a string with N at masked positions
+        '''
+        letters = np.frombuffer(b'ACGTN', dtype=np.uint8)
+        return letters[self.maskedCodes(start, end)].tobytes().decode('ascii')
+
+    def bounds(self, start, end):
+        '''
+        clips start and end to the sequence like a slice does
+        '''
+        if end is None or end > self.length:
+            end = self.length
+        start = min(max(start, 0), end)
+        return start, end
+
+    def nbytes(self):
+        '''
+        returns the memory used by the packed bases and the mask runs
+        '''
+        return self.packed.nbytes + self.maskStarts.nbytes + self.maskEnds.nbytes
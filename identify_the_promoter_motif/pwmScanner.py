@@ -0,0 +1,101 @@
+import numpy as np
+from packedSequence import encodeBases
+
+'''
+Scans sequences for the occurrences of a motif with a log-odds position
+weight matrix, used by randomizedMotifSearch.py to locate the motif it finds
+in a genome.
+
+The matrix is made from a count matrix of base probabilities (as
+createCountMatrix returns them): each entry is log2(probability /
+background probability), so a window scores the sum of the entries of its
+bases. The reverse strand is scanned with the reverse complement of the
+matrix. The best score the rest of a window can still add is precomputed
+for each position, so the windows are scored one position at a time (the
+most selective positions first) and a window is dropped as soon as even the
+best remaining bases could not bring it up to the threshold.
+'''
+
+
+class PwmScanner:
+    '''
+    Finds the windows of sequences that score at least a threshold against a
+    position weight matrix, on both strands.
+
+    Attributes:
+        k = the motif length
+        pwm = 5 x k numpy array of log-odds scores, one row per base code
+              (A, C, G, T) and a row of -inf for any other base
+        pwmRC = the matrix of the reverse complement strand
+        maxScore = the best score any window can reach
+        chunkSize = the number of bases scored at a time
+    '''
+    def __init__(self, countMatrix, background=None, chunkSize=1 << 22):
+        if background is None:
+            background = {'A': 0.25, 'C': 0.25, 'G': 0.25, 'T': 0.25}
+        with np.errstate(divide='ignore'):
+            scores = np.array([np.log2(np.array(countMatrix[base], dtype=float) / background[base]) for base in 'ACGT'])
+        self.k = scores.shape[1]
+        self.pwm = np.vstack((scores, np.full(self.k, -np.inf)))
+        #the complement of code c is 3 - c, read in the other direction
+        self.pwmRC = np.vstack((scores[::-1, ::-1], np.full(self.k, -np.inf)))
+        self.maxScore = float(scores.max(axis=0).sum())
+        self.chunkSize = chunkSize
+
+    def scoringOrder(self, pwm):
+        '''
+        returns the positions of the matrix from the one whose best base
+        stands out most from its average to the one that stands out least,
+        so the windows that cannot reach the threshold are dropped early,
+        and the best score the positions after each one in that order can
+        still add (0 after the last)
+        '''
+        scores = pwm[:4]
+        order = np.argsort(-(scores.max(axis=0) - scores.mean(axis=0)), kind='stable')
+        best = scores.max(axis=0)[order]
+        remaining = np.append(np.cumsum(best[::-1])[::-1], 0)[1:]
+        return order.tolist(), remaining
+
+    def scanCodes(self, codes, threshold, windowStarts=None):
+        '''
+        returns the starts, strands ('+' or '-') and scores of the windows of
+        an array of base codes that score at least threshold, in order of
+        start. only the windows starting in the first windowStarts positions
+        are scored
+        '''
+        windows = max(len(codes) - self.k + 1, 0)
+        if windowStarts is not None:
+            windows = min(windows, windowStarts)
+        hits = []
+        for strand, pwm in (('+', self.pwm), ('-', self.pwmRC)):
+            order, remaining = self.scoringOrder(pwm)
+            #the first position scores every window from a slice of the codes
+            first = order[0]
+            partial = pwm[:, first][codes[first:first + windows]]
+            starts = np.flatnonzero(partial + remaining[0] >= threshold)
+            partial = partial[starts]
+            for j, position in enumerate(order[1:], 1):
+                partial += pwm[:, position][codes[starts + position]]
+                #drop the windows that cannot reach the threshold any more
+                keep = partial + remaining[j] >= threshold
+                starts = starts[keep]
+                partial = partial[keep]
+            hits.append((starts, np.full(len(starts), strand), partial))
+        starts = np.concatenate([hit[0] for hit in hits])
+        order = np.argsort(starts, kind='stable')
+        return starts[order], np.concatenate([hit[1] for hit in hits])[order], np.concatenate([hit[2] for hit in hits])[order]
+
+    def scan(self, reader, threshold):
+        '''
+        yields the record name, start (0 based), end, strand, score and bases
+        of every window of the records of a reader scoring at least
+        threshold. long records are scored a chunk at a time, each chunk
+        overlapping the next by k - 1 bases
+        '''
+        for head, seq in reader.readFasta(asBytes=True):
+            name = head.split()[0] if head.split() else head
+            codes = encodeBases(seq)
+            for chunk in range(0, max(len(codes) - self.k + 1, 0), self.chunkSize):
+                starts, strands, scores = self.scanCodes(codes[chunk:chunk + self.chunkSize + self.k - 1], threshold, self.chunkSize)
+                for start, strand, score in zip((starts + chunk).tolist(), strands.tolist(), scores.tolist()):
+                    yield name, start, start + self.k, strand, score, seq[start:start + self.k].decode('latin-1')
@@ -2,8 +2,11 @@
 # Name: Beth DeVogelaere
 # Date: 2018-10-10
 # Github acct: edevog
+import sys
 import random
 from fastaReader import *
+from packedSequence import encodeBases, PackedSequence
+import numpy as np
 import math
 
 '''
@@ -21,6 +24,48 @@ randomizedMotifSearch.py -i=100000 -p=1 -k=13 <somefile.fa >someOutputFIle.fa
 where i is the number of iterations, p is the number of psuedocounts, and
 k is the motif length.
 
+To search only part of a large fasta file, give the file with -f and a BED
+style file of regions (name, start, end) with -r. The file is indexed once
+(somefile.fa.fai) and only the bases of the regions are read:
+randomizedMotifSearch.py -i=100000 -p=1 -k=13 -f=genome.fa -r=promoters.bed
+
+The restarts can be shared out among several processes with -w. Each worker
+runs its own block of restarts from its own random number stream, derived
+from the seed given with -s, and sends back only its best motif. A run with
+the same seed and number of workers always finds the same motif:
+randomizedMotifSearch.py -i=100000 -p=1 -k=13 -s=7 -w=8 <somefile.fa
+
+With -e gibbs each restart runs a Gibbs sampler instead of greedy profile
+climbing. Each of its -n steps resamples the motif of one sequence from the
+profile of the others, and the best motifs sampled are then improved by
+greedy climbing (benchmarkEngines.py compares the time and window
+evaluations the two engines need to reach an entropy):
+randomizedMotifSearch.py -i=1000 -p=1 -k=13 -e=gibbs -n=200 <somefile.fa
+
+Most searches find their best motif long before -i restarts. --patience stops
+after that many restarts in a row without a lower entropy, and --timeLimit
+stops after that many seconds (-i can then be left out). -t reports the top
+motifs instead of only the best one. The restarts per second and the best
+entropy so far are written to stderr every --progress seconds:
+randomizedMotifSearch.py -p=1 -k=13 --patience=2000 --timeLimit=3600 -t=5 <somefile.fa
+
+For short motifs -e exact replaces the restarts with a branch and bound search
+of every kmer for the median string, the kmer with the smallest total Hamming
+distance to its closest window in each sequence. It prints the median string
+and the entropy of the motif matrix of those closest windows, and the
+subtrees of the search are shared out among the -w workers:
+randomizedMotifSearch.py -p=1 -k=10 -e=exact -w=8 <somefile.fa
+
+--scan reads a genome fasta file and prints every site of the motif found,
+scored on both strands with the log-odds matrix of the count matrix the
+search ended with, whose score reaches --threshold bits:
+randomizedMotifSearch.py -i=10000 -p=1 -k=13 --scan=genome.fa --threshold=12 <somefile.fa
+
+-K searches every motif length in a range from one reading of the fasta
+file, sharing the lengths out among the -w workers, and prints a table of
+the best motif and entropy of each length:
+randomizedMotifSearch.py -i=10000 -p=1 -K=6-20 -w=8 <somefile.fa
+
 Output:
 The promoter motif (the motif from the motif matrix with the lowest entropy)
 and the motif entropy score
@@ -61,6 +106,19 @@ class CommandLine() :
         self.parser.add_argument('-p', '--pseudoCounts', type = int, action = 'store', help='pseudocounts')
         self.parser.add_argument('-i', '--iterations', type = int, action = 'store', help='number of iterations')
         self.parser.add_argument('-k', '--motifLength', type = int, action = 'store', help='the length of the motif')
+        self.parser.add_argument('-K', '--kRange', action = 'store', help='search every motif length in a range like 6-20')
+        self.parser.add_argument('-f', '--fasta', action = 'store', help='fasta file to read instead of stdin')
+        self.parser.add_argument('-r', '--regions', action = 'store', help='BED file of regions of the fasta file to search')
+        self.parser.add_argument('-s', '--seed', type = int, action = 'store', help='seed for the random restarts, makes a run repeatable')
+        self.parser.add_argument('-w', '--workers', type = int, action = 'store', default = 1, help='number of processes running restarts')
+        self.parser.add_argument('-e', '--engine', action = 'store', choices = ['greedy', 'gibbs', 'exact'], default = 'greedy', help='search run by each restart')
+        self.parser.add_argument('-n', '--steps', type = int, action = 'store', help='Gibbs sampling steps per restart, 4 per sequence by default')
+        self.parser.add_argument('-t', '--top', type = int, action = 'store', default = 1, help='number of lowest entropy motifs to report')
+        self.parser.add_argument('--patience', type = int, action = 'store', help='stop after this many restarts in a row without a lower entropy')
+        self.parser.add_argument('--timeLimit', type = float, action = 'store', help='stop starting restarts after this many seconds')
+        self.parser.add_argument('--scan', action = 'store', help='fasta file (a genome) to scan for the motif found')
+        self.parser.add_argument('--threshold', type = float, action = 'store', help='lowest log-odds score (bits) of a reported site, 80%% of the best possible score by default')
+        self.parser.add_argument('--progress', type = float, action = 'store', default = 10, help='seconds between progress lines on stderr, 0 for none')
         if inOpts is None :
             self.args = self.parser.parse_args()
         else :
@@ -79,81 +137,107 @@ class Usage(Exception):
 
 class FindMotif(object):
     """This class find the promoter motif."""
-    def __init__(self, iterations, kmerLength, pseudoCounts):
+    def __init__(self, iterations, kmerLength, pseudoCounts, reader=None, seed=None, engine='greedy', steps=None):
         self.iterations = iterations
         self.kmerLength = kmerLength
         self.pseudoCounts = pseudoCounts
+        #the search run by each restart, greedy profile climbing (bestKmers)
+        #or Gibbs sampling (gibbsKmers) for the given number of steps
+        self.engine = engine
+        self.steps = steps
+        #the number of windows scored against a profile so far, so the
+        #engines can be compared by the work they do
+        self.windowEvaluations = 0
+        #each FindMotif draws from its own random number generator so a
+        #worker process can be given a stream of its own
+        self.rng = random.Random(seed)
         #I am definiting sequences as a member variable because we access the
-        #sequences from our dataset several times throughout this class
+        #sequences from our dataset several times throughout this class. they
+        #are kept packed 2 bits per base, the search works on the codes
+        #matrix built from them
         self.sequences = []
 
-        reader = FastAreader()
-        for head, seq in reader.readFasta():
-            self.sequences.append(seq)
+        if reader is None:
+            reader = FastAreader()
+        for head, seq in reader.readFasta(asBytes=True):
+            self.sequences.append(PackedSequence(seq))
+        self.buildIndex()
+        if self.steps is None:
+            self.steps = 4 * len(self.sequences)
         #I am defining kmerMetrix as a member variable because the matrix is
 
 
 
-    def randomMotif(self, seq):
+    def buildIndex(self):
+        '''
+        builds the integer index of the sequences that every restart reuses,
+        and records the seconds it took in indexSeconds.
+
+        codes holds the base codes (A=0, C=1, G=2, T=3) of the sequences, one
+        row per sequence, so every window of every sequence can be scored at
+        once. short rows and bases other than ACGT are filled with 4, which
+        no kmer can match. windows is a view of codes with the k codes of the
+        window starting at each position, so windows[row, start] is a motif
+        without slicing a string
+        '''
+        import time
+        began = time.perf_counter()
+        self.lengths = np.array([len(seq) for seq in self.sequences], dtype=np.int64)
+        self.unpackCodes()
+        self.setKmerLength(self.kmerLength)
+        self.indexSeconds = time.perf_counter() - began
+
+    def unpackCodes(self):
         '''
-        picks  random kmer from each sequence
+        fills the codes matrix from the packed sequences
         '''
-        seqLength = len(seq)
-        listOfChoices = range(0,(seqLength-self.kmerLength))
-        start = random.choice(listOfChoices)
-        end = start + self.kmerLength
-        randomMotif = seq[start:end]
-        return randomMotif
+        longest = int(self.lengths.max()) if len(self.lengths) else 0
+        self.codes = np.full((len(self.sequences), longest), 4, dtype=np.uint8)
+        for row, seq in enumerate(self.sequences):
+            self.codes[row, :len(seq)] = seq.maskedCodes()
 
+    def setKmerLength(self, kmerLength):
+        '''
+        sets the motif length and remakes the window view of the codes for
+        it, so one encoded set of sequences can be searched at every length
+        '''
+        from numpy.lib.stride_tricks import sliding_window_view
+        self.kmerLength = kmerLength
+        if self.codes.shape[1] < kmerLength:
+            padding = np.full((len(self.sequences), kmerLength - self.codes.shape[1]), 4, dtype=np.uint8)
+            self.codes = np.hstack((self.codes, padding))
+        self.windows = sliding_window_view(self.codes, kmerLength, axis=1)
+        self.windowCount = int(np.maximum(self.lengths - kmerLength + 1, 0).sum())
 
-    def createCountMatrix(self, motifMatrix):
+    def __getstate__(self):
         '''
-        inputs pseudocounts then counts how many times each nucleotide base
-        occurs at each position in the kmers. then divides by the kmer length
+        leaves the window view out of a pickled FindMotif, since pickling a
+        view copies it k times over, and the codes matrix, which is four
+        times the size of the packed sequences. the worker remakes both
         '''
-        #defining the bases found within our sequences
-        bases = ['A', 'C', 'T', 'G']
-        #defining a list of pseudocounts that are independent so when we add
-        #to one list, we do not add to all of the lists
-        pseudoCountList = [[self.pseudoCounts]*self.kmerLength, [self.pseudoCounts]*self.kmerLength, [self.pseudoCounts]*self.kmerLength, [self.pseudoCounts]*self.kmerLength]
-        #creating a count matrix as a dictionary where the bases are the keys
-        #and the psuedocounts are the values
-        countMatrix = dict((zip(bases, pseudoCountList)))
-        #iterate through the lenght of our defined kmer length
-        for i in range(self.kmerLength):
-            #iterate through the kmers in our motif matrix
-            for kmer in motifMatrix:
-                #each time we encounter the ith base in our kmer, add one to
-                #the ith base in our count matrix in the ith column of the
-                #count matrix
-                countMatrix[kmer[i]][i] += 1
-                #in other words we are iterating through the base at every
-                #position of each kmer in our matrix then tracking how many
-                #times that base occurs in that position and storing that
-                #information in the count dict
-        #iterate through the list of counts for each base
-        for countList in countMatrix.values():
-            #iterate through each position's count in the list, divde the
-            #count by the number of sequences then add the psuedocounts
-            #value multiplied by the number of bases (4)
-            countList[:] = [x/(len(self.sequences)+(self.pseudoCounts*4)) for x in countList]
-        return countMatrix
-
-    def createConsensusMotif(self, countMatrix):
-        '''
-        creates the consensus motif base on the alues from the count matrix
-        '''
-        conMotif = []
-        for i in range(0, self.kmerLength):
-            score = 0
-            bestNuc = ""
-            for key in countMatrix:
-                if countMatrix[key][i] > score:
-                    score = countMatrix[key][i]
-                    bestNuc = key
-            conMotif.append(bestNuc)
-        return "".join(conMotif)
+        state = self.__dict__.copy()
+        del state['windows']
+        del state['codes']
+        return state
 
+    def __setstate__(self, state):
+        '''
+        restores a pickled FindMotif and remakes its codes and window view
+        '''
+        self.__dict__.update(state)
+        self.unpackCodes()
+        self.setKmerLength(self.kmerLength)
+
+    def createCountMatrix(self, counts):
+        '''
+        turns a count array of the motif matrix (as motifCounts makes it)
+        into a count matrix: a dictionary of the probability of each base at
+        each position, with the pseudocounts added to every count. windows
+        holding a base other than ACGT are left out of the count
+        '''
+        total = counts[:4].sum(axis=0) + self.pseudoCounts*4
+        #the bases in the order the scoring has always used (A, C, T, G)
+        return dict((base, ((counts[code] + self.pseudoCounts) / total).tolist()) for base, code in zip('ACTG', (0, 1, 3, 2)))
 
     def scoreCountMatrix(self, countMatrix):
         '''
@@ -173,82 +257,427 @@ class FindMotif(object):
         entropy = sum(allColEntropies)*-1
         return entropy
 
-    def scoreKmer(self, countMatrix):
-        '''
-        calculates the score using the probabilities int he countMatrix for
-        each kmer
-        '''
-        listOfBestKmers = []
-        for sequence in self.sequences:
-            scores = []
-            kmers = []
-            #iterate through the number of kmers
-            for i in range(len(sequence) - self.kmerLength+1):
-                #defines the kmer we are working with
-                kmer = sequence[i:i+self.kmerLength]
-                kmers.append(kmer)
-                allProbabilityOfBase = []
-                #iterates through the position of bases in a kmer
-                for j in range(self.kmerLength):
-                    #defines our base
-                    kmerBase = kmer[j]
-                    #finds the probability value of the base
-                    probabilityOfBase = countMatrix[kmerBase][j]
-                    #stores it in a list
-                    allProbabilityOfBase.append(probabilityOfBase)
-                #initialize the score as 1 because we are multiplying
-                score = 1
-                #iterate through our list of probabilities
-                for x in allProbabilityOfBase:
-                    #multiply all the probabilities together to get a score
-                    score *= x
-                #store the score in a list
-                scores.append(score)
-            #finding the index of the best score in the list
-            indexOfBestKmer = scores.index(max(scores))
-            #using the index to pull the best kmer in the list
-            bestKmer = kmers[indexOfBestKmer]
-            #store all best kmers in a list
-            listOfBestKmers.append(bestKmer)
-        return listOfBestKmers
-
-
-    def bestKmers(self):
-        '''
-        finds the best kmer from our initial random starting point
-        '''
-
-        count = 0
-        randomMotifList = []
-        for seq in self.sequences:
-            slices = self.randomMotif(seq)
-            randomMotifList.append(slices)
-        motif_o = randomMotifList
-
-
-        countMatrix_o = self.createCountMatrix(motif_o)
-        #creates a matrix with the nucleotide bases and their counts for each position in a kmer
-        scoreCountMatrix = self.scoreCountMatrix(countMatrix_o)
-        consensusMotif_o = self.createConsensusMotif(countMatrix_o)
+    def profileStarts(self, profile):
+        '''
+        returns the start of the first most probable window of each sequence
+        for a profile of base probabilities, one row per base code (A, C, G,
+        T) and one column per motif position
+        '''
+        #the profile as log probabilities. the extra row of -inf scores any
+        #window holding padding or a base that is not ACGT below every real
+        #kmer
+        with np.errstate(divide='ignore'):
+            logProfile = np.log(profile)
+        logProfile = np.vstack((logProfile, np.full(self.kmerLength, -np.inf)))
+        #sum the log probability of the base at each position of every
+        #window, all sequences at once
+        windows = self.codes.shape[1] - self.kmerLength + 1
+        scores = np.zeros((len(self.sequences), windows))
+        for j in range(self.kmerLength):
+            scores += logProfile[:, j][self.codes[:, j:j+windows]]
+        self.windowEvaluations += self.windowCount
+        return np.argmax(scores, axis=1)
+
+    def motifCounts(self, rows, starts):
+        '''
+        returns a 5 x k array counting the base codes at each position of the
+        motifs starting at starts in the given rows of the sequences
+        '''
+        columns = np.arange(self.kmerLength)
+        counts = np.zeros((5, self.kmerLength), dtype=np.int64)
+        np.add.at(counts, (self.windows[rows, starts], columns), 1)
+        return counts
+
+    def columnEntropy(self, counts, column):
+        '''
+        calculates the entropy term of one column of the motif matrix from
+        its counts, the same way scoreCountMatrix does for a countMatrix
+        '''
+        total = len(self.sequences) + self.pseudoCounts*4
+        colEntropies = []
+        #the bases in the order of the countMatrix keys (A, C, T, G)
+        for code in (0, 1, 3, 2):
+            p = (int(counts[code, column]) + self.pseudoCounts) / total
+            colEntropies.append(p*math.log(p, 2))
+        return sum(colEntropies)
+
+    def countsConsensus(self, counts):
+        '''
+        creates the consensus motif from a count array, ties going to the
+        first base in the order of the countMatrix keys (A, C, T, G)
+        '''
+        order = counts[[0, 1, 3, 2]]
+        return ''.join(['ACTG'[i] for i in np.argmax(order, axis=0).tolist()])
+
+    def bestKmers(self, starts=None):
+        '''
+        finds the best kmer from our initial random starting point, or from
+        the given motif starts. the motif matrix is kept as a count array
+        that is only changed for the sequences whose motif moved, and the
+        entropy is only recalculated for the columns whose counts changed.
+        returns the consensus motif, its entropy and the count array of its
+        motif matrix
+        '''
+        if starts is None:
+            starts = [self.rng.choice(range(0, length - self.kmerLength)) for length in self.lengths.tolist()]
+        starts = np.array(starts, dtype=np.int64)
+        allRows = np.arange(len(self.sequences))
+        counts_o = self.motifCounts(allRows, starts)
+        colEntropies_o = [self.columnEntropy(counts_o, j) for j in range(self.kmerLength)]
+        consensusMotifScore_o = sum(colEntropies_o)*-1
+        total = len(self.sequences) + self.pseudoCounts*4
 
         #start a whie loop to continue until the initial score is less than the new score
         while True:
-            #calculate the entropy of our initial count matrix
-            consensusMotifScore_o = self.scoreCountMatrix(countMatrix_o)
-            #pass the consensus motif over the sequences and create a new kmer matrix
-            motif_new = self.scoreKmer(countMatrix_o)
-            #calculate the counts for the new kmer matrix
-            countMatrix_new = self.createCountMatrix(motif_new)
-            #calculate the entropy of our new count matrix
-            consensusMotifScore_new = self.scoreCountMatrix(countMatrix_new)
-            #create a new consensus motif based on our new counts
-            consensusMotif_new = self.createConsensusMotif(countMatrix_new)
+            #pass the profile over the sequences to find the new motifs
+            newStarts = self.profileStarts((counts_o[:4] + self.pseudoCounts) / total)
+            moved = np.flatnonzero(newStarts != starts)
+            #move the counts of the motifs that changed
+            delta = self.motifCounts(moved, newStarts[moved]) - self.motifCounts(moved, starts[moved])
+            counts_new = counts_o + delta
+            colEntropies_new = list(colEntropies_o)
+            for j in np.flatnonzero(delta.any(axis=0)).tolist():
+                colEntropies_new[j] = self.columnEntropy(counts_new, j)
+            consensusMotifScore_new = sum(colEntropies_new)*-1
             if consensusMotifScore_new >= consensusMotifScore_o:
-                return consensusMotif_o, consensusMotifScore_o
+                return self.countsConsensus(counts_o), consensusMotifScore_o, counts_o
             else:
-                consensusMotif_o = consensusMotif_new
-                countMatrix_o = countMatrix_new
+                starts = newStarts
+                counts_o = counts_new
+                colEntropies_o = colEntropies_new
+                consensusMotifScore_o = consensusMotifScore_new
+
+
+    def gibbsKmers(self):
+        '''
+        finds a motif by Gibbs sampling from a random starting point. each
+        step takes the motif of one random sequence out of the count matrix,
+        picks a new motif for that sequence with probability proportional to
+        its score against the profile of the other motifs and adds it back,
+        so a step only scores the windows of one sequence. the best motif
+        matrix seen is then improved by greedy climbing, and the consensus
+        motif, entropy and count array it reaches are returned
+        '''
+        numSeqs = len(self.sequences)
+        k = self.kmerLength
+        columns = np.arange(k)
+        starts = [self.rng.randrange(0, length - k) for length in self.lengths.tolist()]
+        #counts[base, j] is the number of motifs with base at position j
+        counts = self.motifCounts(np.arange(numSeqs), np.array(starts, dtype=np.int64))
+        bestEntropy = math.inf
+        bestStarts = list(starts)
+        for step in range(self.steps):
+            row = self.rng.randrange(numSeqs)
+            counts[self.windows[row, starts[row]], columns] -= 1
+            #profile of the other motifs, with the -inf row for code 4
+            with np.errstate(divide='ignore'):
+                logProfile = np.log((counts[:4] + self.pseudoCounts) / (numSeqs - 1 + self.pseudoCounts*4))
+            logProfile = np.vstack((logProfile, np.full(k, -np.inf)))
+            windows = int(self.lengths[row]) - k + 1
+            scores = logProfile[self.windows[row, :windows], columns].sum(axis=1)
+            self.windowEvaluations += windows
+            best = scores.max()
+            if best > -np.inf:
+                weights = np.cumsum(np.exp(scores - best))
+                starts[row] = min(int(np.searchsorted(weights, self.rng.random()*weights[-1], side='right')), windows - 1)
+            counts[self.windows[row, starts[row]], columns] += 1
+            #entropy of the profile of all the motifs, as scoreCountMatrix
+            #calculates it
+            p = (counts[:4] + self.pseudoCounts) / (numSeqs + self.pseudoCounts*4)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                entropy = -np.where(p > 0, p*np.log2(p), 0).sum()
+            if entropy < bestEntropy:
+                bestEntropy = entropy
+                bestStarts = list(starts)
+        #finish with greedy climbing from the best motifs sampled
+        return self.bestKmers(bestStarts)
+
+    def runRestarts(self, restarts, patience=None, timeLimit=None, top=1, progress=None, label='restarts'):
+        '''
+        runs random restarts until restarts have been run, patience restarts
+        in a row have not lowered the best entropy, or timeLimit seconds have
+        passed. only the top lowest entropy motifs (each consensus once) are
+        kept. every progress seconds the restarts per second and the best
+        entropy so far are written to stderr. returns the top motifs as
+        (consensus, entropy, counts) triples, lowest entropy first with ties
+        going to the first found, and the number of restarts run
+        '''
+        import time
+        search = self.gibbsKmers if self.engine == 'gibbs' else self.bestKmers
+        topMotifs = []
+        began = time.perf_counter()
+        lastReport = began
+        run = 0
+        sinceBest = 0
+        while run < restarts:
+            now = time.perf_counter()
+            if timeLimit is not None and now - began >= timeLimit:
+                break
+            if patience is not None and sinceBest >= patience:
+                break
+            if progress and now - lastReport >= progress and topMotifs:
+                print('{0}: {1} restarts, {2:.1f} restarts/sec, best {3} {4}'.format(label, run, run / (now - began), topMotifs[0][0], topMotifs[0][1]), file=sys.stderr)
+                lastReport = now
+            consensusMotif, entropy, counts = search()
+            run += 1
+            if not topMotifs or entropy < topMotifs[0][1]:
+                sinceBest = 0
+            else:
+                sinceBest += 1
+            addTopMotif(topMotifs, consensusMotif, entropy, counts, top)
+        return topMotifs, run
+
+
+    def windowMask(self):
+        '''
+        returns a boolean array that is True at the starts of the windows
+        that lie inside their sequence
+        '''
+        starts = np.arange(self.windows.shape[1])
+        return starts[None, :] <= (self.lengths - self.kmerLength)[:, None]
+
+    def totalDistances(self, candidates):
+        '''
+        returns the total over the sequences of the smallest Hamming distance
+        between each candidate (a row of k base codes) and a window of the
+        sequence
+        '''
+        valid = self.windowMask()
+        totals = np.zeros(len(candidates), dtype=np.int64)
+        for row in range(len(self.sequences)):
+            windows = self.windows[row][valid[row]]
+            if not len(windows):
+                continue
+            distances = (candidates[:, None, :] != windows[None, :, :]).sum(axis=2)
+            totals += distances.min(axis=1)
+        return totals
+
+    def medianSearch(self, prefix, sharedBound):
+        '''
+        finds the kmer starting with prefix (a list of base codes) with the
+        smallest total Hamming distance to the sequences by branch and bound.
+        the partial distance of every window to the current prefix is kept
+        for each depth, and a prefix is pruned when the sum over the
+        sequences of its smallest partial distance is above the best total
+        known to any process (sharedBound) or not below the best found here.
+        returns the total distance and codes of the first (alphabetically)
+        best kmer found, or None when every kmer was pruned
+        '''
+        k = self.kmerLength
+        valid = self.windowMask()
+        rows = valid.any(axis=1)
+        windows = self.windows[rows]
+        #windows outside their sequence start too far away to ever be closest
+        partial = np.where(valid[rows], 0, k + 1).astype(np.int16)
+        for depth, base in enumerate(prefix):
+            partial = partial + (windows[:, :, depth] != base)
+        bases = np.arange(4, dtype=np.uint8)[:, None, None]
+        bestTotal = math.inf
+        bestCodes = None
+        #depth first, children pushed in reverse so A is explored first
+        stack = [(len(prefix), list(prefix), partial)]
+        while stack:
+            depth, codes, partial = stack.pop()
+            bound = int(partial.min(axis=1).sum())
+            if bound > sharedBound.value or bound >= bestTotal:
+                continue
+            if depth == k:
+                bestTotal, bestCodes = bound, codes
+                with sharedBound.get_lock():
+                    if bound < sharedBound.value:
+                        sharedBound.value = bound
+                continue
+            children = partial[None] + (windows[None, :, :, depth] != bases)
+            for base in (3, 2, 1, 0):
+                stack.append((depth + 1, codes + [base], children[base]))
+        if bestCodes is None:
+            return None
+        return bestTotal, bestCodes
+
+    def exactSearch(self, workers=1):
+        '''
+        finds the median string: the kmer with the smallest total Hamming
+        distance to the closest window of every sequence, ties going to the
+        first alphabetically. the search starts from the best total of the
+        windows of the first sequences and the subtrees of the first two
+        bases are shared out among worker processes. returns the median
+        string, the entropy of the motif matrix of its closest windows and
+        its total distance, or an empty string, infinity and None when no
+        kmer was found
+        '''
+        import multiprocessing
+        k = self.kmerLength
+        #the windows of the first sequences are good first candidates
+        valid = self.windowMask()
+        candidates = np.unique(self.windows[valid][:2000], axis=0)
+        #a window holding N matches itself, but the search only tries ACGT,
+        #so its total could be a bound that no kmer reaches
+        candidates = candidates[(candidates < 4).all(axis=1)]
+        sharedBound = multiprocessing.Value('q', int(self.totalDistances(candidates).min()) if len(candidates) else k*len(self.sequences))
+        prefixes = [[]] if k < 2 else [[first, second] for first in range(4) for second in range(4)]
+        if workers <= 1:
+            results = [self.medianSearch(prefix, sharedBound) for prefix in prefixes]
+        else:
+            with multiprocessing.Pool(workers, initializer=exactWorkerSetup, initargs=(self, sharedBound)) as pool:
+                results = pool.map(exactWorker, prefixes)
+        #the lowest total, ties going to the first prefix alphabetically
+        results = [result for result in results if result is not None]
+        if not results:
+            return '', math.inf, None
+        total, codes = min(results, key=lambda result: result[0])
+        median = ''.join(['ACGT'[code] for code in codes])
+        return median, self.scoreCountMatrix(self.createCountMatrix(self.motifMatrix(median))), total
+
+    def motifMatrix(self, motif):
+        '''
+        returns the count array of the first window of each sequence that is
+        closest (by Hamming distance) to a motif. windows holding a base
+        other than ACGT are only taken when a sequence has no other window
+        '''
+        k = self.kmerLength
+        distances = (self.windows != encodeBases(motif)).sum(axis=2)
+        distances[(self.windows > 3).any(axis=2)] = k + 1
+        distances[~self.windowMask()] = k + 2
+        starts = np.argmin(distances, axis=1)
+        return self.motifCounts(np.arange(len(self.sequences)), starts)
+
+
+def exactWorkerSetup(ourMotif, sharedBound):
+    '''
+    keeps the FindMotif and the shared best total of an exact search worker
+    '''
+    global exactMotif, exactBound
+    exactMotif = ourMotif
+    exactBound = sharedBound
+
+
+def exactWorker(prefix):
+    '''
+    runs the branch and bound search of one prefix in a worker process
+    '''
+    return exactMotif.medianSearch(prefix, exactBound)
+
+
+def searchWorkerSetup(ourMotif):
+    '''
+    keeps the FindMotif of a restart or sweep worker, so it is sent to each
+    worker once instead of with every task
+    '''
+    global searchMotif
+    searchMotif = ourMotif
+
+
+def sweepWorker(task):
+    '''
+    searches for the best motif of one length of a sweep. the task holds the
+    length, its seed and number of restarts and the stopping and progress
+    settings. returns the length, the motif and its entropy
+    '''
+    kmerLength, seed, restarts, patience, timeLimit, progress = task
+    ourMotif = searchMotif
+    ourMotif.setKmerLength(kmerLength)
+    ourMotif.rng = random.Random(seed)
+    if ourMotif.engine == 'exact':
+        median, entropy, total = ourMotif.exactSearch()
+        return kmerLength, median, entropy
+    topMotifs, run = ourMotif.runRestarts(restarts, patience, timeLimit, 1, progress, 'k={0}'.format(kmerLength))
+    consensusMotif, entropy, counts = topMotifs[0] if topMotifs else ('', math.inf, None)
+    return kmerLength, consensusMotif, entropy
+
+
+def parseRange(text):
+    '''
+    returns the first and last length of a range written as first-last, or
+    as a single length
+    '''
+    try:
+        bounds = [int(x) for x in text.split('-')]
+        first, last = bounds[0], bounds[-1]
+        if len(bounds) > 2:
+            raise ValueError
+    except ValueError:
+        raise Usage('a length range is written as first-last, like 6-20')
+    if not 0 < first <= last:
+        raise Usage('a length range needs 0 < first <= last')
+    return first, last
+
+
+def addTopMotif(topMotifs, consensusMotif, entropy, counts, top):
+    '''
+    adds a motif to a list of the top lowest entropy (consensus, entropy,
+    counts) triples, keeping each consensus once with its lowest entropy and
+    the list sorted with ties in the order they were found
+    '''
+    for i, (kept, keptEntropy, keptCounts) in enumerate(topMotifs):
+        if kept == consensusMotif:
+            if entropy >= keptEntropy:
+                return
+            del topMotifs[i]
+            break
+    if len(topMotifs) >= top and entropy >= topMotifs[-1][1]:
+        return
+    topMotifs.append((consensusMotif, entropy, counts))
+    topMotifs.sort(key=lambda motif: motif[1])
+    del topMotifs[top:]
+
+
+def restartWorker(task):
+    '''
+    runs one block of restarts in a worker process. the task holds the seed
+    of the block, its number of restarts and the stopping, top and progress
+    settings passed on to runRestarts
+    '''
+    seed, restarts, patience, timeLimit, top, progress, label = task
+    ourMotif = searchMotif
+    ourMotif.rng = random.Random(seed)
+    return ourMotif.runRestarts(restarts, patience, timeLimit, top, progress, label)
+
 
+def blockSeeds(seed, blocks):
+    '''
+    returns an independent seed for each block of restarts, derived from
+    the user's seed (or from fresh entropy when it is None)
+    '''
+    return [int(child.generate_state(1, dtype=np.uint64)[0]) for child in np.random.SeedSequence(seed).spawn(blocks)]
+
+
+def scanGenome(ourMotif, counts, fasta, threshold):
+    '''
+    prints the sites of a fasta file that score at least threshold against
+    the position weight matrix of a motif's count array, as tab separated
+    name, start (0 based), end, strand, score and bases. nothing is done
+    when no fasta file was given
+    '''
+    if fasta is None:
+        return
+    from pwmScanner import PwmScanner
+    scanner = PwmScanner(ourMotif.createCountMatrix(counts))
+    if threshold is None:
+        threshold = 0.8 * scanner.maxScore
+    for name, start, end, strand, score, bases in scanner.scan(FastAreader(fasta), threshold):
+        print('{0}\t{1}\t{2}\t{3}\t{4:.2f}\t{5}'.format(name, start, end, strand, score, bases))
+
+
+def makeReader(fasta, regions):
+    '''
+    returns the reader for the sequences: stdin, a fasta file, or the regions
+    of an indexed fasta file
+    '''
+    if regions is not None:
+        if fasta is None:
+            raise Usage('regions (-r) need an indexed fasta file (-f)')
+        try:
+            reader = FastaIndex(fasta, readRegions(regions))
+        except ValueError as err:
+            raise Usage(str(err))
+        for name, start, end in reader.regions:
+            if name not in reader.records:
+                reader.close()
+                raise Usage('region {0} is not a record of {1}'.format(name, fasta))
+        return reader
+    if fasta is not None:
+        return FastAreader(fasta)
+    return FastAreader()
 
 
 def main(myCommandLine=None):
@@ -266,26 +695,92 @@ def main(myCommandLine=None):
         iterations = myCommandLine.args.iterations
         pseudoCounts = myCommandLine.args.pseudoCounts
         kmerLength = myCommandLine.args.motifLength
-
-        ourMotif = FindMotif(iterations, kmerLength, pseudoCounts)
-
-        bestKmers = []
-        for i in range(iterations):
-            bestKmer = ourMotif.bestKmers()
-            bestKmers.append(bestKmer)
-
-        bestKmerDict = {}
-        for j in range(len(bestKmers)):
-            bestKmerDict[bestKmers[j][0]] = bestKmers[j][1]
-
-        winner = math.inf
-        winnerKmer = ''
-        for k in bestKmerDict.keys():
-            if bestKmerDict[k] < winner:
-                winner = bestKmerDict[k]
-                winnerKmer = k
-
-        print(winnerKmer, bestKmerDict[winnerKmer])
+        reader = makeReader(myCommandLine.args.fasta, myCommandLine.args.regions)
+
+        workers = myCommandLine.args.workers
+        if workers < 1:
+            raise Usage('the number of workers must be at least 1')
+        if myCommandLine.args.kRange is not None:
+            kmerRange = parseRange(myCommandLine.args.kRange)
+            kmerLength = kmerRange[0]
+        if kmerLength is None:
+            raise Usage('give the motif length (-k) or a range of lengths (-K)')
+        if myCommandLine.args.engine != 'exact' and iterations is None and myCommandLine.args.patience is None and myCommandLine.args.timeLimit is None:
+            raise Usage('give the number of iterations (-i), a patience or a time limit')
+
+        ourMotif = FindMotif(iterations, kmerLength, pseudoCounts, reader, engine=myCommandLine.args.engine, steps=myCommandLine.args.steps)
+        reader.close()
+        print('indexed {0} windows of {1} sequences in {2:.3f} seconds'.format(ourMotif.windowCount, len(ourMotif.sequences), ourMotif.indexSeconds), file=sys.stderr)
+
+        if myCommandLine.args.kRange is not None:
+            #the sequences were read and encoded once, each length only
+            #remakes its window view. the lengths are shared out among the
+            #workers, each with its own seed
+            lengths = list(range(kmerRange[0], kmerRange[1] + 1))
+            restarts = math.inf if iterations is None else iterations
+            tasks = [(k, seed, restarts, myCommandLine.args.patience, myCommandLine.args.timeLimit, myCommandLine.args.progress) for k, seed in zip(lengths, blockSeeds(myCommandLine.args.seed, len(lengths)))]
+            if workers == 1:
+                searchWorkerSetup(ourMotif)
+                results = [sweepWorker(task) for task in tasks]
+            else:
+                import multiprocessing
+                with multiprocessing.Pool(min(workers, len(lengths)), initializer=searchWorkerSetup, initargs=(ourMotif,)) as pool:
+                    results = pool.map(sweepWorker, tasks)
+            print('{0}\t{1}\t{2}'.format('length', 'motif', 'entropy'))
+            for k, motif, entropy in results:
+                print('{0}\t{1}\t{2}'.format(k, motif, entropy))
+            return
+
+        if myCommandLine.args.engine == 'exact':
+            median, entropy, total = ourMotif.exactSearch(workers)
+            if total is None:
+                raise Usage('the exact search found no kmer of length {0}'.format(kmerLength))
+            print('median string total Hamming distance {0}'.format(total), file=sys.stderr)
+            print(median, entropy)
+            scanGenome(ourMotif, ourMotif.motifMatrix(median), myCommandLine.args.scan, myCommandLine.args.threshold)
+            return
+
+        #split the restarts into one block per worker, each with its own seed
+        top = myCommandLine.args.top
+        if top < 1:
+            raise Usage('the number of motifs to report must be at least 1')
+        progress = myCommandLine.args.progress
+        if iterations is None:
+            blocks = [math.inf] * workers
+        else:
+            workers = min(workers, max(iterations, 1))
+            blocks = [iterations // workers + (1 if b < iterations % workers else 0) for b in range(workers)]
+        tasks = []
+        for b, (seed, restarts) in enumerate(zip(blockSeeds(myCommandLine.args.seed, workers), blocks)):
+            label = 'worker {0}'.format(b + 1) if workers > 1 else 'restarts'
+            tasks.append((seed, restarts, myCommandLine.args.patience, myCommandLine.args.timeLimit, top, progress, label))
+        import time
+        began = time.perf_counter()
+        if workers == 1:
+            searchWorkerSetup(ourMotif)
+            results = [restartWorker(tasks[0])]
+        else:
+            import multiprocessing
+            with multiprocessing.Pool(workers, initializer=searchWorkerSetup, initargs=(ourMotif,)) as pool:
+                results = pool.map(restartWorker, tasks)
+        seconds = time.perf_counter() - began
+
+        #the best block results, ties going to the earlier block
+        topMotifs = []
+        restartsRun = 0
+        for blockMotifs, run in results:
+            restartsRun += run
+            for consensusMotif, entropy, counts in blockMotifs:
+                addTopMotif(topMotifs, consensusMotif, entropy, counts, top)
+        if progress:
+            print('{0} restarts in {1:.1f} seconds, {2:.1f} restarts/sec'.format(restartsRun, seconds, restartsRun / max(seconds, 1e-9)), file=sys.stderr)
+
+        for consensusMotif, entropy, counts in topMotifs:
+            print(consensusMotif, entropy)
+        if topMotifs:
+            #the matrix the search ended with, not one remade from the
+            #consensus
+            scanGenome(ourMotif, topMotifs[0][2], myCommandLine.args.scan, myCommandLine.args.threshold)
 
 
 
@@ -0,0 +1,121 @@
+import numpy as np
+from packedSequence import reverseComplementCodes
+
+'''
+A count-min sketch of the kmers of one length, used by missingMotif.py when
+exact count tables would not fit in memory.
+
+The sketch is a depth x width table of counters. Each row hashes a kmer code
+to one counter, and the estimated count of a kmer is the smallest of its depth
+counters. Estimates are never below the true count, and with probability
+1 - e^-depth they are at most e/width * (number of kmers added) above it.
+Conservative update only raises the counters of a kmer as far as its new
+estimate, which keeps the overestimates well under that bound in practice.
+'''
+
+
+class CountMinSketch:
+    '''
+    Approximate counts of canonical kmer codes in fixed memory.
+
+    Attributes:
+        k = the kmer length
+        width = the number of counters in each row (a power of 2)
+        depth = the number of rows
+        seed = the seed of the row hash functions, sketches with the same
+               seed, width and depth can be merged
+        table = depth x width numpy int64 array of counters
+        multipliers = odd multiplier of each row's hash
+        addends = addend of each row's hash
+        total = the number of kmers added
+    '''
+    def __init__(self, k, width, depth, seed=0):
+        self.k = k
+        self.bits = max(int(width).bit_length() - 1, 1)
+        self.width = 1 << self.bits
+        self.depth = depth
+        self.seed = seed
+        self.table = np.zeros((depth, self.width), dtype=np.int64)
+        rng = np.random.default_rng(seed + 1000003*k)
+        self.multipliers = rng.integers(0, 2**63, size=depth, dtype=np.uint64)*np.uint64(2) + np.uint64(1)
+        self.addends = rng.integers(0, 2**63, size=depth, dtype=np.uint64)
+        self.total = 0
+
+    def canonical(self, codes):
+        '''
+        returns the canonical code (the smaller of the kmer and its reverse
+        complement) of each code
+        '''
+        return np.minimum(codes, reverseComplementCodes(codes, self.k))
+
+    def buckets(self, codes):
+        '''
+        returns the counter each row uses for each canonical code, using
+        multiply-shift hashing
+        '''
+        shift = np.uint64(64 - self.bits)
+        return [((codes*self.multipliers[row] + self.addends[row]) >> shift).astype(np.intp) for row in range(self.depth)]
+
+    def add(self, codes, counts=None):
+        '''
+        counts one occurrence of each kmer code, or counts[i] occurrences of
+        codes[i] when counts are given, with conservative update
+        '''
+        if not len(codes):
+            return
+        if counts is None:
+            codes, counts = np.unique(self.canonical(np.asarray(codes, dtype=np.uint64)), return_counts=True)
+        else:
+            codes, inverse = np.unique(self.canonical(np.asarray(codes, dtype=np.uint64)), return_inverse=True)
+            counts = np.bincount(inverse, weights=counts).astype(np.int64)
+        buckets = self.buckets(codes)
+        estimate = self.table[0][buckets[0]]
+        for row in range(1, self.depth):
+            estimate = np.minimum(estimate, self.table[row][buckets[row]])
+        estimate += counts
+        for row in range(self.depth):
+            np.maximum.at(self.table[row], buckets[row], estimate)
+        self.total += int(counts.sum())
+
+    def flush(self):
+        '''
+        the sketch has no buffer, kept so it can stand in for a KmerTable
+        '''
+        pass
+
+    def shard(self):
+        '''
+        returns the arrays another sketch needs to merge these counts
+        '''
+        return self.table, self.total
+
+    def merge(self, table, total):
+        '''
+        adds the counters of another sketch with the same seed, width and depth
+        '''
+        self.table += table
+        self.total += total
+
+    def lookup(self, codes):
+        '''
+        returns the estimated count of each kmer code plus its reverse
+        complement
+        '''
+        buckets = self.buckets(self.canonical(np.asarray(codes, dtype=np.uint64)))
+        estimate = self.table[0][buckets[0]]
+        for row in range(1, self.depth):
+            estimate = np.minimum(estimate, self.table[row][buckets[row]])
+        return estimate
+
+    def errorBound(self):
+        '''
+        returns the amount an estimate can exceed the true count with
+        probability 1 - e^-depth
+        '''
+        return np.e/self.width*self.total
+
+    def nbytes(self):
+        '''
+        returns the memory used by the counters
+        '''
+        return self.table.nbytes
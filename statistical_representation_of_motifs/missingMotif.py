@@ -3,8 +3,12 @@
 # Name: Beth DeVogelaere
 # Date: 2018-10-02
 # Github acct: edevog
-import itertools as it
+import sys
+import numpy as np
 from fastaReader import *
+from packedSequence import *
+from countMinSketch import CountMinSketch
+from suffixIndex import SuffixIndex
 
 '''
 This program reads a fasta file from STDIN and ranks motifs based on how
@@ -13,6 +17,9 @@ statistically underrepresented the specific motif is.
 Input:
 A fasta file of a sequence where the first line contains a carrot (>) so the
 fastareader works.
+Kmers are only counted inside the runs of ACGT bases. N and the other IUPAC
+codes end a run, and the number of those bases and of the windows skipped
+because of them is written to stderr.
 
 To call the program in the command line follow the following format:
     missingMotif.py -m 3 -M 8 -c -5
@@ -20,6 +27,44 @@ To call the program in the command line follow the following format:
 where m is the min motif length, M is the max motif length, and c is the
 z-score cut off value
 
+Inputs too large to count exactly can be counted approximately in a fixed
+amount of memory with -s (megabytes). Lengths whose exact table could not fit
+in their share are counted with a count-min sketch, and each row then reports
+the most its count can be over the true count, with probability 1 - delta
+(--delta, default 0.01):
+    missingMotif.py -m 12 -M 16 -c -5 -s 4096 <genome.fa
+A sketch cannot list its kmers, so the candidates of the length after a
+sketched length are found by reading the input again. stdin is kept in a
+temporary file for this, or in the database (-d) when there is one.
+
+Only the first N rows of the report are printed with -t N:
+    missingMotif.py -m 3 -M 8 -c -5 -t 100
+
+The counts can be kept in a database directory with -d so a later run with a
+new cutoff or smaller motif range scores them without recounting. -u adds
+another fasta file to the counts in an existing database:
+    missingMotif.py -m 3 -M 12 -d genome.kmers <genome.fa
+    missingMotif.py -m 6 -M 10 -c -8 -d genome.kmers
+    missingMotif.py -d genome.kmers -u -f moreContigs.fa
+
+Counting can be spread over several processes with -w. The records (and
+pieces of long records) are shared out among the workers and their counts
+are summed before the z-scores are calculated:
+    missingMotif.py -m 3 -M 8 -c -5 -w 32 <metagenome.fa
+
+A suffix array index of the input can be built once with -i and then counts
+the motifs of any range of lengths without reading the fasta file again. -q
+prints the count of a single kmer of any length (with its reverse complement)
+straight from the index:
+    missingMotif.py -m 3 -M 8 -c -5 -i genome.sa <genome.fa
+    missingMotif.py -m 10 -M 20 -c -8 -i genome.sa
+    missingMotif.py -i genome.sa -q GATTACAGATTACAGATTACAGATTACAGATTACA
+
+To count only part of a large fasta file, give the file with -f and a BED
+style file of regions (name, start, end) with -r. The file is indexed once
+(somefile.fa.fai) and only the bases of the regions are read:
+    missingMotif.py -m 3 -M 8 -c -5 -f genome.fa -r windows.bed
+
 Output:
 A report with headers ranking motifs by their kmer length
 ---longest to shortest--- then zscore---lowest to highest.
@@ -70,9 +115,19 @@ class CommandLine() :
                                              prefix_chars = '-',
                                              usage = '%(prog)s [m, M, c] -minMotif[3] -maxMotif[8] -cutoff[-5] <fastafile >txtfile'
                                              )
-        self.parser.add_argument('-m', '--minMotif', type = int, action = 'store', default = 3, help = 'this is the min kmer size')
-        self.parser.add_argument('-M', '--maxMotif', type = int, action = 'store', default = 8, help = 'this is the max kmer size')
+        self.parser.add_argument('-m', '--minMotif', type = int, action = 'store', help = 'this is the min kmer size (3)')
+        self.parser.add_argument('-M', '--maxMotif', type = int, action = 'store', help = 'this is the max kmer size (8)')
         self.parser.add_argument('-c', '--cutoff', type = float, action = 'store', default = -5, help = 'this is the Z-Score cut off')
+        self.parser.add_argument('-f', '--fasta', action = 'store', help = 'fasta file to read instead of stdin')
+        self.parser.add_argument('-r', '--regions', action = 'store', help = 'BED file of regions of the fasta file to count')
+        self.parser.add_argument('-t', '--top', type = int, action = 'store', help = 'only report this many motifs')
+        self.parser.add_argument('-d', '--database', action = 'store', help = 'directory of saved kmer counts to reuse, made when missing')
+        self.parser.add_argument('-u', '--update', action = 'store_true', default = False, help = 'add the fasta input to the counts in the database')
+        self.parser.add_argument('-s', '--sketch', type = float, action = 'store', help = 'count approximately in this many megabytes')
+        self.parser.add_argument('--delta', type = float, action = 'store', default = 0.01, help = 'chance an approximate count exceeds its error bound')
+        self.parser.add_argument('-w', '--workers', type = int, action = 'store', default = 1, help = 'number of processes counting kmers')
+        self.parser.add_argument('-i', '--index', action = 'store', help = 'directory of a suffix array index of the input to count from, built when missing')
+        self.parser.add_argument('-q', '--query', action = 'append', help = 'print the count of this kmer (any length) from the index and exit')
         if inOpts is None :
             self.args = self.parser.parse_args()
         else :
@@ -90,71 +145,490 @@ class Usage(Exception):
 
 
 
+def sumByCode(codes, counts=None):
+    '''
+    returns the sorted unique codes of an array and the summed counts of each
+    (a count of one per code when counts is None)
+    '''
+    order = np.argsort(codes, kind='stable')
+    codes = codes[order]
+    starts = np.flatnonzero(np.concatenate(([True], codes[1:] != codes[:-1]))) if len(codes) else np.zeros(0, dtype=np.intp)
+    if counts is None:
+        summed = np.diff(np.append(starts, len(codes)))
+    else:
+        summed = np.add.reduceat(counts[order], starts) if len(codes) else counts[:0]
+    return codes[starts], summed.astype(np.int64)
+
+
+class KmerTable(object):
+    """
+    The counts of the kmers of one length that have been seen, stored as a
+    sorted array of canonical kmer codes and an array of their counts.
+
+    A kmer and its reverse complement share one entry under the smaller of
+    their two codes (the canonical code). New codes are collected in a buffer
+    and merged into the sorted arrays in batches.
+
+    Attributes:
+        k = the kmer length
+        codes = sorted numpy uint64 array of the canonical codes seen
+        counts = numpy int64 array of the count of each code
+        pending = the buffered arrays of canonical codes not yet merged
+        pendingSize = the number of codes in the buffer
+        bufferSize = the number of buffered codes that triggers a merge
+    """
+    def __init__(self, k, bufferSize=1 << 24):
+        self.k = k
+        self.codes = np.zeros(0, dtype=np.uint64)
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.pending = []
+        self.pendingSize = 0
+        self.bufferSize = bufferSize
+
+    def canonical(self, codes):
+        '''
+        returns the canonical code (the smaller of the kmer and its reverse
+        complement) of each code
+        '''
+        return np.minimum(codes, reverseComplementCodes(codes, self.k))
+
+    def add(self, codes, counts=None):
+        '''
+        counts one occurrence of each kmer code, or counts[i] occurrences of
+        codes[i] when counts are given
+        '''
+        if counts is not None:
+            self.merge(*sumByCode(self.canonical(np.asarray(codes, dtype=np.uint64)), counts))
+        elif len(codes):
+            self.pending.append(self.canonical(codes))
+            self.pendingSize += len(codes)
+            if self.pendingSize >= self.bufferSize:
+                self.flush()
+
+    def flush(self):
+        '''
+        merges the buffered codes into the sorted arrays
+        '''
+        if not self.pending:
+            return
+        newCodes, newCounts = np.unique(np.concatenate(self.pending), return_counts=True)
+        self.pending = []
+        self.pendingSize = 0
+        self.mergeSorted(newCodes, newCounts)
+
+    def merge(self, codes, counts):
+        '''
+        adds the sorted canonical codes and counts of another table, such as
+        a shard counted by a worker process
+        '''
+        self.flush()
+        self.mergeSorted(codes, counts)
+
+    def mergeSorted(self, newCodes, newCounts):
+        '''
+        adds sorted unique canonical codes and their counts to the table
+        '''
+        if len(self.codes):
+            self.codes, self.counts = sumByCode(np.concatenate((self.codes, newCodes)), np.concatenate((self.counts, newCounts)))
+        else:
+            self.codes, self.counts = newCodes, newCounts.astype(np.int64)
+
+    def lookup(self, codes):
+        '''
+        returns the count of each kmer code plus the count of its reverse
+        complement, 0 for kmers that were never seen
+        '''
+        self.flush()
+        codes = self.canonical(np.asarray(codes, dtype=np.uint64))
+        where = np.minimum(np.searchsorted(self.codes, codes), max(len(self.codes) - 1, 0))
+        found = (self.codes[where] == codes) if len(self.codes) else np.zeros(len(codes), dtype=bool)
+        return np.where(found, self.counts[where] if len(self.codes) else 0, 0)
+
+    def shard(self):
+        '''
+        returns the arrays another table needs to merge these counts
+        '''
+        self.flush()
+        return self.codes, self.counts
+
+    def errorBound(self):
+        '''
+        the counts are exact
+        '''
+        return 0
+
+    def __len__(self):
+        self.flush()
+        return len(self.codes)
+
+
 class KmerData(object):
     """
     This class determines the expected count and z-score based on the actual
-    count for every possible kmer
+    count for every kmer that is seen or could be expected
 
     Attributes:
         kmerMin = the minimum motif size to evaluate
         kmerMax = the maximum motif size to evaluate
         zScoreCutOff = the z-score cutoff
-        kmerDict = a dictionary of all possible kmers for the given kmerMin and
-                    kmerMax lengths provided and bases A, C, T, G as the keys
-                    and the counts of the kmers as the values
+        kmerTables = a dictionary of kmer lengths and the KmerTable holding
+                     the counts of the kmers of that length that were seen,
+                     or the CountMinSketch estimating them
+        chunkSize = the number of positions of a long sequence encoded at once
+        sketchBytes = the memory allowed for approximate counting, None for
+                      exact counting
+        delta = the chance an approximate count is off by more than its
+                error bound
+        sketched = True when any length is counted approximately
+        bufferSize = the number of codes an exact table buffers before merging
+        readers = the readers of the counted fasta files, read again for the
+                  candidates of a length after a sketched length
+        index = the SuffixIndex that was counted, None when the fasta files
+                were read
+        skippedBases = the number of bases other than ACGT read
+        skippedWindows = a dictionary of kmer lengths and the number of
+                         windows of that length not counted because they
+                         hold a base other than ACGT
     """
-    def __init__(self, kmerMin, kmerMax, zScoreCutOff):
+    #complement of every base and IUPAC code, upper and lower case
+    complement = str.maketrans('ACGTUNRYSWKMBDHVacgtunryswkmbdhv', 'TGCAANYRSWMKVHDBtgcaanyrswmkvhdb')
+    #bytes of temporary arrays for each position of a counted chunk, and for
+    #each buffered code of an exact table or candidate table
+    chunkBytes = 96
+    bufferBytes = 32
+
+    def __init__(self, kmerMin, kmerMax, zScoreCutOff, chunkSize=1 << 22, sketchBytes=None, delta=0.01):
         self.kmerMin = kmerMin
         self.kmerMax = kmerMax
         self.zScoreCutOff = zScoreCutOff
-        self.kmerDict = {}
-
-
-        #creating every possible kmer using itertools and populated the keys
-        #of a dictionary with the kmers
+        self.chunkSize = chunkSize
+        self.delta = delta
+        self.bufferSize = 1 << 24
+        self.readers = []
+        self.index = None
+        if self.kmerMax > 32:
+            raise Usage('the max motif size can be at most 32')
+        self.setBudget(sketchBytes)
+        #only the kmers that occur are stored, so nothing is enumerated up
+        #front and long motifs cost memory in proportion to the input
+        self.kmerTables = {}
         for k in range(self.kmerMin, self.kmerMax + 1):
-            for i in it.product('ACGT', repeat = k):
-                self.kmerDict[''.join(i)] = [0]
-            for kmer in self.kmerDict:
-                if kmer == self.reverseComplement(kmer):
-                    pass
-                if kmer > self.reverseComplement(kmer):
-                    self.kmerDict[kmer] = self.kmerDict[self.reverseComplement(kmer)]
+            self.kmerTables[k] = self.makeTable(k)
+        self.sketched = any(isinstance(table, CountMinSketch) for table in self.kmerTables.values())
+        self.skippedBases = 0
+        self.skippedWindows = dict((k, 0) for k in range(max(self.kmerMin, 1), self.kmerMax + 1))
+
+    def setBudget(self, sketchBytes):
+        '''
+        sets the memory budget. a quarter of it is kept for the arrays of the
+        chunk being counted and the buffers of the exact tables, so the chunks
+        and buffers are made small enough to fit
+        '''
+        self.sketchBytes = sketchBytes
+        if sketchBytes is None:
+            return
+        workBytes = sketchBytes // 4
+        self.chunkSize = min(self.chunkSize, max(1 << 10, workBytes // (2 * self.chunkBytes)))
+        self.bufferSize = max(1 << 10, workBytes // (2 * self.bufferBytes * (self.kmerMax - self.kmerMin + 1)))
+
+    def makeTable(self, k):
+        '''
+        returns an exact KmerTable for length k, or a CountMinSketch when a
+        memory budget was given and an exact table for the length could grow
+        past its share of the budget
+        '''
+        if self.sketchBytes is None:
+            return KmerTable(k, self.bufferSize)
+        import math
+        share = (self.sketchBytes - self.sketchBytes // 4) // (self.kmerMax - self.kmerMin + 1)
+        #an exact table holds at most about 4^k / 2 canonical codes at 16
+        #bytes (code and count) each
+        if 8 * 4**k <= share:
+            return KmerTable(k, self.bufferSize)
+        depth = max(1, math.ceil(math.log(1/self.delta)))
+        width = share // (8 * depth)
+        if width < 2:
+            raise Usage('the sketch memory is too small for {0} motif sizes'.format(self.kmerMax - self.kmerMin + 1))
+        return CountMinSketch(k, width, depth)
+
+
+    def tableLayout(self):
+        '''
+        returns a dictionary of kmer lengths and None for an exact table or
+        the (width, depth, seed) of a sketch, so the same tables can be made
+        again to count more input
+        '''
+        return dict((k, None if isinstance(table, KmerTable) else (table.width, table.depth, table.seed)) for k, table in self.kmerTables.items())
 
+    def makeTables(self, layout):
+        '''
+        replaces the count tables with empty tables of a layout made by
+        tableLayout
+        '''
+        self.kmerTables = dict((k, KmerTable(k, self.bufferSize) if shape is None else CountMinSketch(k, *shape)) for k, shape in layout.items())
+        self.sketched = any(shape is not None for shape in layout.values())
 
     def reverseComplement(self, dna):
-        #stackoverflow
         '''
-        determines the reverse kmer of a sequence
+        determines the reverse kmer of a sequence. IUPAC codes are replaced by
+        their complementary codes and any other character is kept as it is
+        '''
+        return dna[::-1].translate(self.complement)
+
+    def countKmers(self, seq, windowStarts=None):
+        '''
+        counts every kmer of every length in a PackedSequence. the sequence
+        is split into its maximal segments of ACGT bases up front, so runs of N
+        and other IUPAC codes are never scanned, and each segment is counted
+        in a single pass: the 2 bit code of the longest kmer starting at each
+        position is built once and the code of every shorter kmer starting
+        there is a prefix of it, so each length is counted with one shift.
+        long segments are encoded a chunk at a time, each chunk overlapping
+        the next by kmerMax - 1 bases, and only a chunk is ever unpacked.
+
+        when windowStarts is given only the kmers starting in the first
+        windowStarts positions are counted, so a piece of a longer sequence
+        can be counted without counting its overlap with the next piece twice
+        '''
+        n = len(seq)
+        if windowStarts is None:
+            windowStarts = n
+            #the empty kmer occurs once before every base and after the last
+            emptyKmers = n + 1
+        else:
+            emptyKmers = windowStarts
+        if self.kmerMin == 0:
+            self.kmerTables[0].add(np.zeros(emptyKmers, dtype=np.uint64))
+        #the ACGT segments lie between the masked runs of other bases
+        starts = np.concatenate(([0], seq.maskEnds))
+        ends = np.concatenate((seq.maskStarts, [n]))
+        self.skippedBases += int(windowStarts - np.clip(ends, 0, windowStarts).sum() + np.clip(starts, 0, windowStarts).sum())
+        for k in self.skippedWindows:
+            windows = max(min(windowStarts, n - k + 1), 0)
+            counted = np.maximum(np.minimum(ends - k + 1, windowStarts) - starts, 0).sum()
+            self.skippedWindows[k] += int(windows - counted)
+        keep = (ends - starts >= max(self.kmerMin, 1)) & (starts < windowStarts)
+        for start, end in zip(starts[keep].tolist(), ends[keep].tolist()):
+            segmentStarts = min(end, windowStarts) - start
+            for chunk in range(0, segmentStarts, self.chunkSize):
+                self.countChunk(seq.codes(start + chunk, min(start + chunk + self.chunkSize + self.kmerMax - 1, end)), min(self.chunkSize, segmentStarts - chunk))
+
+    def countChunk(self, codes, windowStarts):
         '''
-        complement = {'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A'}
+        counts the kmers of every length that start in the first windowStarts
+        positions of an array of ACGT base codes
+        '''
+        n = len(codes)
+        #pad the end so the longest code exists at every position, the padding
+        #is shifted away for kmers that fit inside the segment
+        padded = np.zeros(n + self.kmerMax - 1, dtype=np.uint8)
+        padded[:n] = codes
+        longCodes = windowCodes(padded, self.kmerMax)[:windowStarts]
+        for k in range(max(self.kmerMin, 1), self.kmerMax + 1):
+            self.kmerTables[k].add(longCodes[:max(n - k + 1, 0)] >> np.uint64(2*(self.kmerMax - k)))
+
+    def countIndex(self, index):
+        '''
+        counts the kmers of every length from a SuffixIndex of the sequences
+        instead of reading them
+        '''
+        self.index = index
+        if self.kmerMin == 0:
+            emptyKmers = int(index.recordLengths.sum()) + len(index.recordLengths)
+            self.kmerTables[0].add(np.zeros(1, dtype=np.uint64), np.array([emptyKmers]))
+        if self.kmerMax >= 1:
+            for k, codes, counts in index.kmerCounts(max(self.kmerMin, 1), self.kmerMax):
+                self.kmerTables[k].add(codes, counts)
+
+    def skippedReport(self):
+        '''
+        returns a line describing the bases other than ACGT and the windows
+        of each length that were not counted
+        '''
+        windows = ' '.join('{0}:{1}'.format(k, self.skippedWindows[k]) for k in sorted(self.skippedWindows))
+        return 'skipped {0} bases other than ACGT and the windows holding them (length:windows {1})'.format(self.skippedBases, windows)
+
+    def countFasta(self, reader, workers=1, shardSize=1 << 24):
+        '''
+        counts the kmers of every record from the reader. with more than one
+        worker, the records are split into shards of about shardSize bases
+        that worker processes count into their own tables, and the tables are
+        summed when every shard is done
+        '''
+        if reader.fname != '':
+            self.readers.append(reader)
+        if workers <= 1:
+            for head, seq in reader.readFasta(asBytes=True):
+                self.countKmers(PackedSequence(seq))
+            return
+        import multiprocessing
+        #a bounded task queue keeps only a few shards in memory at a time
+        tasks = multiprocessing.Queue(2*workers)
+        results = multiprocessing.Queue()
+        settings = (self.kmerMin, self.kmerMax, self.sketchBytes, self.tableLayout())
+        pool = [multiprocessing.Process(target=countWorker, args=(settings, tasks, results)) for i in range(workers)]
+        for process in pool:
+            process.start()
         try:
-            return ''.join([complement[base] for base in dna[::-1]])
-        except KeyError:
-            pass
+            for shard in self.makeShards(reader, shardSize):
+                tasks.put(shard)
+        finally:
+            for process in pool:
+                tasks.put(None)
+        errors = []
+        for process in pool:
+            result = results.get()
+            if isinstance(result, str):
+                errors.append(result)
+            else:
+                shard, skippedBases, skippedWindows = result
+                self.mergeCounts(shard)
+                self.skippedBases += skippedBases
+                for k, windows in skippedWindows.items():
+                    self.skippedWindows[k] += windows
+        for process in pool:
+            process.join()
+        if errors:
+            raise RuntimeError('counting worker failed:\n' + errors[0])
+
+    def makeShards(self, reader, shardSize):
+        '''
+        yields lists of (PackedSequence, windowStarts) pieces holding about
+        shardSize bases, packed so a shard costs a quarter of its bases to
+        send to a worker. records longer than a shard are cut into pieces
+        that overlap the next piece by kmerMax - 1 bases
+        '''
+        shard = []
+        bases = 0
+        for head, seq in reader.readFasta(asBytes=True):
+            for start in range(0, max(len(seq), 1), shardSize):
+                if start + shardSize >= len(seq):
+                    shard.append((PackedSequence(seq[start:]), None))
+                else:
+                    shard.append((PackedSequence(seq[start:start + shardSize + self.kmerMax - 1]), shardSize))
+                bases += min(shardSize, len(seq) - start)
+                if bases >= shardSize:
+                    yield shard
+                    shard = []
+                    bases = 0
+        if shard:
+            yield shard
+
+    def shardCounts(self):
+        '''
+        returns the counts of every length as arrays, (codes, counts) for
+        exact tables and (counters, total) for sketches, so they can be sent to
+        another process and merged
+        '''
+        shard = {}
+        for k, table in self.kmerTables.items():
+            shard[k] = table.shard()
+        return shard
 
-    def countKmers(self, seq):
+    def mergeCounts(self, shard):
         '''
-        reads in all the kmers from the sequence, then counts how many times the kmer
-        from the sequence matches a kmer in the dictionary
+        adds the counts of a shard made by shardCounts to this table
         '''
+        for k, arrays in shard.items():
+            self.kmerTables[k].merge(*arrays)
+
+    def save(self, directory, sources=()):
+        '''
+        writes the count tables to a database directory as one pair of .npy
+        files (codes and counts) per kmer length plus a metadata.json file
+        naming the lengths and the fasta inputs counted. files are written
+        next to the old ones and then moved over them, so a database can be
+        saved over the one it was loaded from
+        '''
+        import os
+        import json
+        os.makedirs(directory, exist_ok=True)
+        sketches = {}
+        for k, table in self.kmerTables.items():
+            if isinstance(table, CountMinSketch):
+                arrays = (('sketch', table.table),)
+                sketches[k] = {'total': table.total, 'seed': table.seed}
+            else:
+                table.flush()
+                arrays = (('codes', table.codes), ('counts', table.counts))
+            for name, values in arrays:
+                path = os.path.join(directory, '{0}{1}.npy'.format(name, k))
+                np.save(path + '.tmp.npy', values)
+                os.replace(path + '.tmp.npy', path)
+        metadata = {'kmerMin': self.kmerMin, 'kmerMax': self.kmerMax, 'sources': list(sources), 'sketches': sketches, 'sketchBytes': self.sketchBytes}
+        with open(os.path.join(directory, 'metadata.json.tmp'), 'w') as metaH:
+            json.dump(metadata, metaH, indent=1)
+        os.replace(os.path.join(directory, 'metadata.json.tmp'), os.path.join(directory, 'metadata.json'))
+
+    def load(self, directory):
+        '''
+        replaces the count tables with the ones saved in a database directory.
+        the arrays are memory mapped, so only the parts of the tables that are
+        looked up are read from disk. every length from kmerMin to kmerMax
+        must be in the database. when a length is sketched, its fasta inputs
+        are kept as readers if they can all be read again
+        '''
+        import os
+        metadata = readDatabaseInfo(directory)
+        if self.kmerMin < metadata['kmerMin'] or self.kmerMax > metadata['kmerMax']:
+            raise Usage('the database {0} holds motif sizes {1} to {2} only'.format(directory, metadata['kmerMin'] + 2, metadata['kmerMax']))
+        sketches = metadata.get('sketches', {})
         for k in range(self.kmerMin, self.kmerMax + 1):
-            for i in range(len(seq) - k + 1):
-                kmerFromSeq = (seq[i:i+k])
-                try:
-                    if kmerFromSeq in self.kmerDict.keys():
-                        self.kmerDict[kmerFromSeq][0] += 1
-                except KeyError:
-                    pass
+            if str(k) in sketches:
+                counters = np.load(os.path.join(directory, 'sketch{0}.npy'.format(k)))
+                table = CountMinSketch(k, counters.shape[1], counters.shape[0], sketches[str(k)]['seed'])
+                table.table = counters
+                table.total = sketches[str(k)]['total']
+            else:
+                table = KmerTable(k)
+                table.codes = np.load(os.path.join(directory, 'codes{0}.npy'.format(k)), mmap_mode='r')
+                table.counts = np.load(os.path.join(directory, 'counts{0}.npy'.format(k)), mmap_mode='r')
+            self.kmerTables[k] = table
+        self.sketched = any(isinstance(table, CountMinSketch) for table in self.kmerTables.values())
+        if self.sketched:
+            #databases saved without their budget get one the sketches fill
+            sketchBytes = metadata.get('sketchBytes')
+            if sketchBytes is None:
+                sketchBytes = 4 * sum(table.table.nbytes for table in self.kmerTables.values() if isinstance(table, CountMinSketch)) // 3
+            self.setBudget(sketchBytes)
+            self.readers = []
+            for source in metadata['sources']:
+                fasta, sep, regions = source.rpartition(':')
+                #a sketched count of stdin keeps a copy of it in the database
+                spool = os.path.join(directory, 'stdin.fa')
+                if source == 'stdin' and metadata['sources'].count(source) == 1 and os.path.exists(spool):
+                    self.readers.append(makeReader(spool, None))
+                elif os.path.exists(source):
+                    self.readers.append(makeReader(source, None))
+                elif sep and os.path.exists(fasta) and os.path.exists(regions):
+                    self.readers.append(makeReader(fasta, regions))
+                else:
+                    self.readers = []
+                    break
+        return metadata['sources']
+
+    def close(self):
+        '''
+        closes the readers kept for finding candidates
+        '''
+        for reader in self.readers:
+            reader.close()
+        self.readers = []
+
+    def kmerCount(self, kmer):
+        '''
+        returns the count of a kmer plus the count of its reverse complement
+        '''
+        return int(self.kmerTables[len(kmer)].lookup([encodeKmer(kmer)])[0])
 
     def calcExpectedCount(self, kmer):
         '''
         calculates the expected count of a kmer
         '''
         expectedCount = 0
-        prek = self.kmerDict[kmer[:-1]][0]
-        sufk = self.kmerDict[kmer[1:]][0]
-        midk = self.kmerDict[kmer[1:-1]][0]
+        prek = self.kmerCount(kmer[:-1])
+        sufk = self.kmerCount(kmer[1:])
+        midk = self.kmerCount(kmer[1:-1])
         expectedCount = (prek*sufk)/(midk)
         return expectedCount
 
@@ -166,11 +640,96 @@ class KmerData(object):
         '''
 
         expectedCount = self.calcExpectedCount(kmer)
-        kmerCount = self.kmerDict[kmer][0]
+        kmerCount = self.kmerCount(kmer)
         zScore = 0
         zScore = (kmerCount - expectedCount)/(expectedCount**(0.5))
         return zScore
 
+    def candidateCodes(self, k, blockSize=1 << 22):
+        '''
+        yields blocks of the sorted canonical codes of the kmers of length k
+        that can have an expected count above zero: those whose prefix was
+        seen, found by extending each seen kmer of length k - 1 and its
+        reverse complement by every base.
+
+        a sketch cannot list the kmers it has seen, so when length k - 1 is
+        sketched the kmers of length k - 1 are found again in the counted
+        sequences. the candidates are collected one range of codes at a time,
+        with as many passes over the sequences as it takes to keep each range
+        inside a quarter of the memory budget. when that would read more
+        windows than there are canonical kmers of length k, or the sequences
+        cannot be read again, every canonical kmer is a candidate instead
+        '''
+        shorter = self.kmerTables[k - 1]
+        if not isinstance(shorter, CountMinSketch):
+            shorter.flush()
+            prefixes = np.concatenate((shorter.codes, reverseComplementCodes(shorter.codes, k - 1)))
+            extended = (prefixes[:, None] << np.uint64(2)) | np.arange(4, dtype=np.uint64)
+            yield sumByCode(np.minimum(extended.ravel(), reverseComplementCodes(extended.ravel(), k)))[0]
+            return
+        #every window of length k - 1 was added to the sketch once, and each
+        #one is the prefix or suffix of 8 candidates
+        windows = 8 * shorter.total
+        parts = -(-min(windows, 4**k // 2 + 1) * self.bufferBytes // max(self.sketchBytes // 4, 1))
+        if 4**k <= windows * parts or (not self.readers and self.index is None):
+            for start in range(0, 4**k, blockSize):
+                codes = np.arange(start, min(start + blockSize, 4**k), dtype=np.uint64)
+                yield codes[codes <= reverseComplementCodes(codes, k)]
+            return
+        bases = np.arange(4, dtype=np.uint64)
+        span = -(-4**k // parts)
+        for part in range(parts):
+            low, high = np.uint64(part * span), np.uint64(min((part + 1) * span, 4**k))
+            found = KmerTable(k, self.bufferSize)
+            for prefixes in self.windowPrefixes(k - 1):
+                extended = np.concatenate((((prefixes[:, None] << np.uint64(2)) | bases).ravel(), ((bases[:, None] << np.uint64(2*(k - 1))) | prefixes).ravel()))
+                extended = found.canonical(extended)
+                found.add(extended[(extended >= low) & (extended < high)])
+            found.flush()
+            for start in range(0, len(found.codes), blockSize):
+                yield found.codes[start:start + blockSize]
+
+    def windowPrefixes(self, k):
+        '''
+        yields arrays of the codes of the kmers of length k in the counted
+        sequences, read again from their fasta files or listed by their index
+        '''
+        if self.index is not None:
+            for length, codes, counts in self.index.kmerCounts(k, k):
+                yield codes
+            return
+        for reader in self.readers:
+            for head, seq in reader.readFasta(asBytes=True):
+                codes = encodeBases(seq)
+                masked = np.concatenate(([True], codes > 3, [True]))
+                edges = np.flatnonzero(masked[1:] != masked[:-1])
+                for start, end in zip(edges[0::2].tolist(), edges[1::2].tolist()):
+                    for chunk in range(start, end - k + 1, self.chunkSize):
+                        yield windowCodes(codes[chunk:min(chunk + self.chunkSize + k - 1, end)], k)
+
+    def scoreKmers(self, k):
+        '''
+        calculates the counts, expected counts and zscores of every candidate
+        kmer of length k as whole arrays, and returns the canonical codes,
+        counts, expected counts and zscores of the kmers at or under the
+        zscore cutoff. kmers whose expected count is zero are skipped
+        '''
+        columns = [[], [], [], []]
+        for codes in self.candidateCodes(k):
+            counts = self.kmerTables[k].lookup(codes)
+            prefixCounts = self.kmerTables[k - 1].lookup(codes >> np.uint64(2))
+            suffixCounts = self.kmerTables[k - 1].lookup(codes & np.uint64(4**(k - 1) - 1))
+            middleCounts = self.kmerTables[k - 2].lookup((codes >> np.uint64(2)) & np.uint64(4**(k - 2) - 1))
+            seen = (prefixCounts > 0) & (suffixCounts > 0)
+            expected = (prefixCounts[seen]*suffixCounts[seen])/middleCounts[seen]
+            zScores = (counts[seen] - expected)/np.sqrt(expected)
+            keep = zScores <= self.zScoreCutOff
+            for column, values in zip(columns, (codes[seen][keep], counts[seen][keep], expected[keep], zScores[keep])):
+                column.append(values)
+        if len(columns[0]) == 1:
+            return tuple(column[0] for column in columns)
+        return tuple(np.concatenate(column) for column in columns)
+
     def getData(self):
         '''
         calls the functions to calulate the expected count and zscore. appends
@@ -178,17 +737,123 @@ class KmerData(object):
         to a list of list
         '''
         outArray = []
-        for kmer, count in self.kmerDict.items():
-            if len(kmer) >= self.kmerMin + 2:
-                kmerRC = self.reverseComplement(kmer)
-                kmerWithComplements = kmer + ":" + kmerRC
-                countVal = count[0]
-                expCount = self.calcExpectedCount(kmer)
-                zScore = self.calcZscore(kmer)
-                if zScore <=  self.zScoreCutOff and kmer <= kmerRC:
-                    outArray.append([kmer, kmerRC, count[0], self.calcExpectedCount(kmer), self.calcZscore(kmer)])
+        for k in range(self.kmerMin + 2, self.kmerMax + 1):
+            codes, counts, expected, zScores = self.scoreKmers(k)
+            kmers = decodeKmers(codes, k)
+            kmerRCs = decodeKmers(reverseComplementCodes(codes, k), k)
+            for row in zip(kmers.tolist(), kmerRCs.tolist(), counts.tolist(), expected.tolist(), zScores.tolist()):
+                outArray.append(list(row))
         return outArray
 
+    def getReport(self, top=None):
+        '''
+        returns the lengths, canonical codes, counts, expected counts,
+        zscores and count error bounds of the kmers under the cutoff, ordered
+        longest to shortest then by zscore (lowest first) then alphabetically.
+        when top is given only the first top rows are kept, selecting them
+        from each length with a partition instead of sorting every row
+        '''
+        columns = [[], [], [], [], [], []]
+        remaining = top
+        for k in range(self.kmerMax, self.kmerMin + 1, -1):
+            if remaining is not None and remaining <= 0:
+                break
+            codes, counts, expected, zScores = self.scoreKmers(k)
+            if remaining is not None and len(zScores) > remaining:
+                #keep every row that can be among the best remaining rows,
+                #including ties on the last zscore, for the sort to settle
+                worst = np.partition(zScores, remaining - 1)[remaining - 1]
+                best = zScores <= worst
+                codes, counts, expected, zScores = codes[best], counts[best], expected[best], zScores[best]
+            errors = np.full(len(codes), self.kmerTables[k].errorBound(), dtype=float)
+            for column, values in zip(columns, (np.full(len(codes), k), codes, counts, expected, zScores, errors)):
+                column.append(values)
+            if remaining is not None:
+                remaining -= len(codes)
+        lengths, codes, counts, expected, zScores, errors = [np.concatenate(c) if c else np.zeros(0) for c in columns]
+        order = np.lexsort((codes, zScores, -lengths))
+        if top is not None:
+            order = order[:top]
+        return lengths[order], codes[order], counts[order], expected[order], zScores[order], errors[order]
+
+
+def countWorker(settings, tasks, results):
+    '''
+    counts the shards taken from the task queue until it receives None, then
+    puts its counts (or the error that stopped it) on the result queue.
+    settings holds the kmerMin, kmerMax, sketchBytes and table layout of the
+    parent so the counts can be merged
+    '''
+    finished = False
+    try:
+        kmerMin, kmerMax, sketchBytes, layout = settings
+        kmerData = KmerData(kmerMin, kmerMax, 0)
+        kmerData.setBudget(sketchBytes)
+        kmerData.makeTables(layout)
+        for shard in iter(tasks.get, None):
+            for seq, windowStarts in shard:
+                kmerData.countKmers(seq, windowStarts)
+        finished = True
+        results.put((kmerData.shardCounts(), kmerData.skippedBases, kmerData.skippedWindows))
+    except Exception:
+        import traceback
+        results.put(traceback.format_exc())
+        #drain the queue so the parent is never blocked on a full queue
+        if not finished:
+            for shard in iter(tasks.get, None):
+                pass
+
+
+def readDatabaseInfo(directory):
+    '''
+    returns the metadata of a kmer count database, or None when the
+    directory does not hold one
+    '''
+    import os
+    import json
+    path = os.path.join(directory, 'metadata.json')
+    if not os.path.exists(path):
+        return None
+    with open(path) as metaH:
+        return json.load(metaH)
+
+
+def openIndex(directory, reader):
+    '''
+    returns the SuffixIndex saved in a directory, building it from the
+    sequences of the reader and saving it there when it is missing
+    '''
+    import os
+    index = SuffixIndex()
+    if os.path.exists(os.path.join(directory, 'suffixArray.npy')):
+        index.load(directory)
+    else:
+        index.build(seq for head, seq in reader.readFasta(asBytes=True))
+        index.save(directory)
+    return index
+
+
+def makeReader(fasta, regions):
+    '''
+    returns the reader for the sequences: stdin, a fasta file, or the regions
+    of an indexed fasta file
+    '''
+    if regions is not None:
+        if fasta is None:
+            raise Usage('regions (-r) need an indexed fasta file (-f)')
+        try:
+            reader = FastaIndex(fasta, readRegions(regions))
+        except ValueError as err:
+            raise Usage(str(err))
+        for name, start, end in reader.regions:
+            if name not in reader.records:
+                reader.close()
+                raise Usage('region {0} is not a record of {1}'.format(name, fasta))
+        return reader
+    if fasta is not None:
+        return FastAreader(fasta)
+    return FastAreader()
+
 
 def main(myCommandLine=None):
     '''
@@ -206,25 +871,132 @@ def main(myCommandLine=None):
         # interpret the list passed from the caller of main as the commandline.
         myCommandLine = CommandLine(myCommandLine)
 
+    reader = None
+    kmerData = None
     try:
-        minKmer = myCommandLine.args.minMotif - 2
-        maxKmer = myCommandLine.args.maxMotif
+        #an update only scores the database when the sizes were asked for
+        sizesGiven = myCommandLine.args.minMotif is not None or myCommandLine.args.maxMotif is not None
+        minKmer = (3 if myCommandLine.args.minMotif is None else myCommandLine.args.minMotif) - 2
+        maxKmer = 8 if myCommandLine.args.maxMotif is None else myCommandLine.args.maxMotif
         zScoreCutOff = myCommandLine.args.cutoff
-        reader = FastAreader()
-        kmerData = KmerData(minKmer, maxKmer, zScoreCutOff)
-
-        for head, seq in reader.readFasta():
-            kmerData.countKmers(seq)
-        print("{0:8}:{1:8}\t{2:4}\t{3:7}\t{4:5}".format("sequence", "reverse", "count", 'Expect', "Zscore"))
-        allData = kmerData.getData()
-        #sorts data by length of sequence then by zscore
-        sortedData = sorted(sorted(allData, key=lambda x: x[4]), key=lambda y: len(y[0]), reverse = True)
-
-        for x in sortedData:
-            print("{0:8}:{1:8}\t{2:0d}\t{3:.2f}\t{4:0.2f}".format(x[0], x[1], x[2], x[3], x[4]))
+        reader = makeReader(myCommandLine.args.fasta, myCommandLine.args.regions)
+        if myCommandLine.args.top is not None and myCommandLine.args.top < 1:
+            raise Usage('the number of motifs to report must be at least 1')
+        sketchBytes = None
+        if myCommandLine.args.sketch is not None:
+            sketchBytes = int(myCommandLine.args.sketch * 2**20)
+            if not 0 < myCommandLine.args.delta < 1:
+                raise Usage('delta must be between 0 and 1')
+        if myCommandLine.args.workers < 1:
+            raise Usage('the number of workers must be at least 1')
+        database = myCommandLine.args.database
+        source = myCommandLine.args.fasta or 'stdin'
+        if myCommandLine.args.regions is not None:
+            source += ':' + myCommandLine.args.regions
+        info = readDatabaseInfo(database) if database is not None else None
+        if myCommandLine.args.update and database is None:
+            raise Usage('update (-u) needs a database (-d)')
+        if info is not None and not myCommandLine.args.update and not myCommandLine.args.query:
+            #the counts come from the database, so the input would be unused
+            if myCommandLine.args.fasta is not None or myCommandLine.args.index is not None:
+                raise Usage('the database {0} already holds counts, add the input to them with -u'.format(database))
+            if not sys.stdin.isatty():
+                print('ignoring stdin, the counts come from the database {0} (add the input with -u)'.format(database), file=sys.stderr)
+
+        index = None
+        if myCommandLine.args.index is not None:
+            index = openIndex(myCommandLine.args.index, reader)
+        elif myCommandLine.args.query:
+            raise Usage('queries (-q) need an index (-i)')
+        if myCommandLine.args.query:
+            for kmer in myCommandLine.args.query:
+                kmer = kmer.upper()
+                kmerRC = kmer[::-1].translate(str.maketrans('ACGT', 'TGCA'))
+                count = index.count(kmer) + (index.count(kmerRC) if kmerRC != kmer else 0)
+                print("{0}:{1}\t{2:0d}".format(kmer, kmerRC, count))
+            return
+
+        if info is None:
+            #count the input, then save the counts when a database was named
+            kmerData = KmerData(minKmer, maxKmer, zScoreCutOff, sketchBytes=sketchBytes, delta=myCommandLine.args.delta)
+            if index is not None:
+                kmerData.countIndex(index)
+            else:
+                if kmerData.sketched and reader.fname == '':
+                    #the candidates after a sketched length are found by
+                    #reading the input again, so stdin is kept in a file, in
+                    #the database when there is one
+                    import os
+                    import shutil
+                    import tempfile
+                    if database is not None:
+                        os.makedirs(database, exist_ok=True)
+                        spool = open(os.path.join(database, 'stdin.fa'), 'w+b')
+                    else:
+                        spool = tempfile.NamedTemporaryFile(suffix='.fa')
+                    shutil.copyfileobj(sys.stdin.buffer, spool)
+                    spool.flush()
+                    reader = FastAreader(spool.name)
+                kmerData.countFasta(reader, myCommandLine.args.workers)
+                print(kmerData.skippedReport(), file=sys.stderr)
+            if database is not None:
+                kmerData.save(database, [source])
+        elif myCommandLine.args.update:
+            #add the input to the saved counts of every length in the database
+            kmerData = KmerData(info['kmerMin'], info['kmerMax'], zScoreCutOff)
+            sources = kmerData.load(database)
+            newData = KmerData(info['kmerMin'], info['kmerMax'], zScoreCutOff)
+            #count the new input the same way (exact or with the same
+            #sketch sizes and budget) as the saved counts so they can be merged
+            newData.setBudget(kmerData.sketchBytes)
+            newData.makeTables(kmerData.tableLayout())
+            if index is not None:
+                newData.countIndex(index)
+            else:
+                newData.countFasta(reader, myCommandLine.args.workers)
+                print(newData.skippedReport(), file=sys.stderr)
+            kmerData.mergeCounts(newData.shardCounts())
+            kmerData.save(database, sources + [source])
+            if not sizesGiven:
+                print('added {0} to the database {1}'.format(source, database), file=sys.stderr)
+                return
+        if info is not None:
+            #score from the saved counts without reading the input
+            if kmerData is not None:
+                kmerData.close()
+            kmerData = KmerData(minKmer, maxKmer, zScoreCutOff)
+            kmerData.load(database)
+
+        #rows come back sorted by length of sequence then by zscore
+        lengths, codes, counts, expected, zScores, errors = kmerData.getReport(myCommandLine.args.top)
+        if kmerData.sketched:
+            #approximate counts are reported with the most they can be over
+            #their true count (with probability 1 - delta)
+            print("{0:8}:{1:8}\t{2:4}\t{3:7}\t{4:5}\t{5:5}".format("sequence", "reverse", "count", 'Expect', "Zscore", "Error"))
+        else:
+            print("{0:8}:{1:8}\t{2:4}\t{3:7}\t{4:5}".format("sequence", "reverse", "count", 'Expect', "Zscore"))
+
+        kmers = np.empty(len(codes), dtype=object)
+        kmerRCs = np.empty(len(codes), dtype=object)
+        for k in np.unique(lengths).tolist():
+            sameLength = lengths == k
+            kmers[sameLength] = decodeKmers(codes[sameLength], k)
+            kmerRCs[sameLength] = decodeKmers(reverseComplementCodes(codes[sameLength], k), k)
+
+        for x in zip(kmers, kmerRCs, counts.tolist(), expected.tolist(), zScores.tolist(), errors.tolist()):
+            if kmerData.sketched:
+                print("{0:8}:{1:8}\t{2:0d}\t{3:.2f}\t{4:0.2f}\t{5:.2f}".format(x[0], x[1], x[2], x[3], x[4], x[5]))
+            else:
+                print("{0:8}:{1:8}\t{2:0d}\t{3:.2f}\t{4:0.2f}".format(x[0], x[1], x[2], x[3], x[4]))
 
     except Usage as err:
        print (err.msg)
+    finally:
+        #release the memory maps of indexed fasta files
+        if reader is not None:
+            reader.close()
+        if kmerData is not None:
+            kmerData.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,268 @@
+import numpy as np
+from packedSequence import encodeBases, windowCodes
+
+'''
+A suffix array and LCP array over a set of DNA sequences, used by
+missingMotif.py to count kmers of any length from one prebuilt index.
+
+The records are joined into one text of base codes (A=0, C=1, G=2, T=3) with
+a separator (4) after each record and in place of every base other than ACGT,
+so no kmer is counted across a record boundary or a run of N. The suffix
+array lists the start of every suffix of the text in sorted order, so all the
+occurrences of a kmer are next to each other, and the LCP array holds the
+length of the prefix each suffix shares with the one before it.
+'''
+
+
+class SuffixIndex:
+    '''
+    Counts kmers of any length from a suffix array over a set of sequences.
+
+    Attributes:
+        text = numpy uint8 array of the base codes of every record, each
+               followed by the separator 4
+        suffixArray = numpy int64 array of the suffix starts in sorted order
+        lcp = numpy int64 array, lcp[i] is the length of the prefix of the
+              ACGT bases shared by suffixes suffixArray[i-1] and suffixArray[i]
+        recordLengths = numpy int64 array of the length of each record
+    '''
+    def __init__(self, sequences=None):
+        self.text = np.zeros(0, dtype=np.uint8)
+        self.suffixArray = np.zeros(0, dtype=np.int64)
+        self.lcp = np.zeros(0, dtype=np.int64)
+        self.recordLengths = np.zeros(0, dtype=np.int64)
+        if sequences is not None:
+            self.build(sequences)
+
+    def build(self, sequences):
+        '''
+        builds the index from an iterable of sequences
+        '''
+        pieces = []
+        lengths = []
+        for seq in sequences:
+            pieces.append(np.minimum(encodeBases(seq), 4))
+            pieces.append(np.full(1, 4, dtype=np.uint8))
+            lengths.append(len(seq))
+        self.text = np.concatenate(pieces) if pieces else np.zeros(0, dtype=np.uint8)
+        self.recordLengths = np.array(lengths, dtype=np.int64)
+        self.suffixArray = self.sortSuffixes()
+        self.lcp = self.makeLcp()
+
+    def sortSuffixes(self):
+        '''
+        sorts the suffixes of the text by prefix doubling. suffixes are first
+        grouped by their first 21 symbols, then each round sorts the members
+        of every group that still holds more than one suffix by the group of
+        the suffix h symbols later, doubling h until every group is a single
+        suffix. a group is ranked by its first position in the suffix array,
+        so splitting one group never changes the rank of another
+        '''
+        n = len(self.text)
+        if n == 0:
+            return np.zeros(0, dtype=np.int64)
+        #3 bits per symbol, shifted up by one so the end of the text sorts
+        #before every symbol
+        h = 21
+        padded = np.zeros(n + h, dtype=np.uint64)
+        padded[:n] = self.text.astype(np.uint64) + np.uint64(1)
+        keys = np.zeros(n, dtype=np.uint64)
+        for j in range(h):
+            keys = (keys << np.uint64(3)) | padded[j:j+n]
+        order = np.argsort(keys, kind='stable').astype(np.int64)
+        keys = keys[order]
+        slots = np.arange(n)
+        changed = np.concatenate(([True], keys[1:] != keys[:-1]))
+        rank = np.empty(n, dtype=np.int64)
+        while True:
+            heads = np.maximum.accumulate(np.where(changed, slots, -1))
+            rank[order[slots]] = heads
+            #keep the slots of groups with more than one member
+            single = changed & np.append(changed[1:], True)
+            slots = slots[~single]
+            if not len(slots):
+                break
+            suffixes = order[slots]
+            later = np.full(len(slots), -1, dtype=np.int64)
+            inText = suffixes + h < n
+            later[inText] = rank[suffixes[inText] + h]
+            heads = rank[suffixes]
+            perm = np.lexsort((later, heads))
+            order[slots] = suffixes[perm]
+            later = later[perm]
+            heads = heads[perm]
+            changed = np.concatenate(([True], (heads[1:] != heads[:-1]) | (later[1:] != later[:-1])))
+            h *= 2
+        return order
+
+    def runs(self):
+        '''
+        returns the number of ACGT bases from each position of the text to
+        the next separator
+        '''
+        n = len(self.text)
+        separators = np.flatnonzero(self.text == 4)
+        positions = np.arange(n)
+        return separators[np.searchsorted(separators, positions)] - positions
+
+    def words(self):
+        '''
+        returns the 2 bit code of the 32 bases starting at each position of
+        the text, separators and the end of the text coded as A
+        '''
+        n = len(self.text)
+        padded = np.zeros(n + 31, dtype=np.uint8)
+        padded[:n] = np.where(self.text > 3, 0, self.text)
+        return windowCodes(padded, 32)
+
+    def makeLcp(self):
+        '''
+        returns the LCP array. neighbouring suffixes are compared 32 bases
+        at a time, finding the first differing base in each word by binary
+        search, and the shared prefix is cut at the first separator. while
+        each round settles at least half of the pairs still being compared
+        the rounds go on; the pairs left, which share long repeats, are
+        finished by Kasai's scan in text order, which starts each suffix
+        from the prefix the suffix before it shared less one base. the
+        whole array is found with O(n) comparisons
+        '''
+        n = len(self.suffixArray)
+        lcp = np.zeros(n, dtype=np.int64)
+        if n < 2:
+            return lcp
+        words = self.words()
+        runs = self.runs()
+        first = self.suffixArray[:-1]
+        second = self.suffixArray[1:]
+        limit = np.minimum(runs[first], runs[second])
+        shared = np.zeros(n - 1, dtype=np.int64)
+        active = np.flatnonzero(limit > 0)
+        while len(active):
+            wordA = words[first[active] + shared[active]]
+            wordB = words[second[active] + shared[active]]
+            low = np.zeros(len(active), dtype=np.int64)
+            high = np.full(len(active), 32, dtype=np.int64)
+            for step in range(6):
+                middle = (low + high + 1) // 2
+                shift = (2*(32 - middle)).astype(np.uint64)
+                same = (wordA >> shift) == (wordB >> shift)
+                low = np.where(same, middle, low)
+                high = np.where(same, high, middle - 1)
+            shared[active] += low
+            remaining = active[(low == 32) & (shared[active] < limit[active])]
+            if 2 * len(remaining) > len(active):
+                active = remaining
+                break
+            active = remaining
+        lcp[1:] = np.minimum(shared, limit)
+        if len(active):
+            self.extendLcp(lcp, active)
+        return lcp
+
+    def extendLcp(self, lcp, pairs):
+        '''
+        finishes the LCP of the neighbouring suffixes pairs[i] and
+        pairs[i] + 1 of the suffix array by Kasai's scan. the suffixes are
+        visited in text order, and a suffix shares at least one base less
+        than the suffix one position before it in the text, so each starts
+        from that bound and compares blocks of bases that double in length
+        until they differ
+        '''
+        text = self.text.tobytes()
+        rank = np.empty(len(self.suffixArray), dtype=np.int64)
+        rank[self.suffixArray] = np.arange(len(self.suffixArray))
+        order = np.argsort(self.suffixArray[pairs + 1])
+        pairs = pairs[order]
+        starts = self.suffixArray[pairs + 1]
+        #the bound each suffix inherits from the suffix before it in the
+        #text, for suffixes whose neighbour is not being extended
+        before = np.where(starts > 0, lcp[rank[np.maximum(starts - 1, 0)]] - 1, 0)
+        others = self.suffixArray[pairs]
+        runs = self.runs()
+        limits = np.minimum(runs[others], runs[starts])
+        last = -2
+        lastShared = 0
+        for pair, b, a, bound, known, end in zip(pairs.tolist(), starts.tolist(), others.tolist(), before.tolist(), lcp[pairs + 1].tolist(), limits.tolist()):
+            h = max(known, lastShared - 1 if b == last + 1 else bound)
+            step = 64
+            while h < end:
+                size = min(step, end - h)
+                if text[a+h:a+h+size] == text[b+h:b+h+size]:
+                    h += size
+                    step *= 2
+                elif size > 8:
+                    step = size // 2
+                else:
+                    while text[a+h] == text[b+h]:
+                        h += 1
+                    break
+            lcp[pair + 1] = h
+            last = b
+            lastShared = h
+
+    def kmerCounts(self, kmerMin, kmerMax):
+        '''
+        yields each length k from kmerMin to kmerMax with the sorted codes of
+        the kmers of that length in the text and the number of times each
+        occurs, found by scanning the LCP array: a run of suffixes sharing at
+        least k bases is one kmer
+        '''
+        if not 0 < kmerMin <= kmerMax <= 32:
+            raise ValueError('kmer lengths must be between 1 and 32')
+        n = len(self.suffixArray)
+        runs = self.runs()[self.suffixArray]
+        words = self.words()
+        for k in range(kmerMin, kmerMax + 1):
+            starts = np.flatnonzero(self.lcp < k)
+            counts = np.diff(np.append(starts, n))
+            valid = runs[starts] >= k
+            codes = words[self.suffixArray[starts[valid]]] >> np.uint64(2*(32 - k))
+            yield k, codes, counts[valid].astype(np.int64)
+
+    def count(self, kmer):
+        '''
+        returns the number of times a kmer of any length occurs, found by
+        binary search of the suffix array
+        '''
+        pattern = encodeBases(kmer)
+        if (pattern > 3).any() or len(pattern) == 0:
+            return 0
+        pattern = pattern.tobytes()
+        text = self.text
+        k = len(pattern)
+        low, high = 0, len(self.suffixArray)
+        while low < high:
+            middle = (low + high) // 2
+            start = self.suffixArray[middle]
+            if text[start:start+k].tobytes() < pattern:
+                low = middle + 1
+            else:
+                high = middle
+        first = low
+        high = len(self.suffixArray)
+        while low < high:
+            middle = (low + high) // 2
+            start = self.suffixArray[middle]
+            if text[start:start+k].tobytes() <= pattern:
+                low = middle + 1
+            else:
+                high = middle
+        return low - first
+
+    def save(self, directory):
+        '''
+        writes the index arrays to a directory as .npy files
+        '''
+        import os
+        os.makedirs(directory, exist_ok=True)
+        for name in ('text', 'suffixArray', 'lcp', 'recordLengths'):
+            np.save(os.path.join(directory, name + '.npy'), getattr(self, name))
+
+    def load(self, directory):
+        '''
+        reads index arrays written by save, memory mapping the large ones
+        '''
+        import os
+        for name in ('text', 'suffixArray', 'lcp'):
+            setattr(self, name, np.load(os.path.join(directory, name + '.npy'), mmap_mode='r'))
+        self.recordLengths = np.load(os.path.join(directory, 'recordLengths.npy'))